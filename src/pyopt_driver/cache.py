@@ -0,0 +1,105 @@
+"""
+Bounded evaluation cache for the pyOpt driver.
+
+Optimizers frequently ask for a design point that they have already seen.
+The cache stores the results of previous evaluations keyed on the design
+vector so that a repeated request does not have to re-run the model.
+"""
+
+from collections import OrderedDict
+
+# pylint: disable=E0611,F0401
+from numpy import asarray, errstate, iscomplexobj, rint, where
+
+# Beyond this many multiples of the tolerance, floats can't be quantized.
+_EXACT = 2.0**52
+
+
+class EvaluationCache(object):
+    """ Least-recently-used cache keyed on a design vector.
+
+    size: int
+        Maximum number of entries held. A size of 0 disables the cache.
+
+    tol: float
+        Design vectors are quantized to multiples of `tol` before they are
+        used as keys, so points that differ by less than this are treated
+        as the same point.
+    """
+
+    def __init__(self, size=0, tol=1e-12):
+
+        self.size = size
+        self.tol = tol
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, x):
+        return self.key(x) in self._entries
+
+    def key(self, x):
+        """ Returns a hashable key for the design vector `x`."""
+
+        x = asarray(x)
+        if iscomplexobj(x):
+            # Complex-step perturbations are far smaller than any sensible
+            # tolerance, so complex points are keyed exactly.
+            return 'c' + x.astype(complex).tostring()
+
+        x = x.astype(float)
+        if self.tol <= 0.0:
+            return (x + 0.0).tostring()
+
+        # The rounded values stay floats, since large values divided by a
+        # small tolerance overflow any integer type. Where the spacing of
+        # floats is already coarser than `tol`, the value itself is used,
+        # and a mask of those entries keeps the two kinds of key apart.
+        # Adding 0 turns -0 into 0.
+        with errstate(over='ignore', invalid='ignore'):
+            quantized = rint(x / self.tol)
+            exact = ~(abs(quantized) < _EXACT)
+        quantized = where(exact, x, quantized) + 0.0
+        return exact.tostring() + quantized.tostring()
+
+    def get(self, x):
+        """ Returns the stored value for `x`, or None if there isn't one."""
+
+        if self.size <= 0:
+            return None
+
+        key = self.key(x)
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        # Re-insert so that this entry becomes the most recently used.
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, x, value):
+        """ Stores `value` for `x`, evicting the least recently used entry
+        if the cache is full."""
+
+        if self.size <= 0:
+            return
+
+        key = self.key(x)
+        self._entries.pop(key, None)
+        self._entries[key] = value
+
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Removes all entries and resets the hit/miss counters."""
+
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
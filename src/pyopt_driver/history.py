@@ -0,0 +1,377 @@
+"""
+Streaming optimization history for the pyOpt driver.
+
+Every call to the driver's objfunc and gradfunc is appended to an on-disk
+store made of fixed-size chunks of raw float64 files plus a small JSON index.
+Each run gets its own directory below the history directory. Each call is
+written and flushed as soon as it is made, so a run that dies part way
+through still has every call up to the last one on disk. The reader
+memory-maps the chunks, so a slice of a long run can be read without loading
+the rest of it.
+
+Layout of a run directory::
+
+    index.json                   dimensions and list of full chunks per stream
+    eval_000000_x.bin            design variables, one row per call
+    eval_000000_f.bin            objectives
+    eval_000000_g.bin            constraints
+    eval_000000_fail.bin         failure flags
+    eval_000000_time.bin         wall time of the call, seconds
+    grad_000000_x.bin            design variables
+    grad_000000_df.bin           objective gradients, one matrix per call
+    grad_000000_dg.bin           constraint gradients
+    ...
+
+The index is only rewritten when a chunk fills up and when the writer is
+closed. The chunk after the last one in the index is the one still being
+written, and its length is found from the size of its files.
+
+Results of failed calls are stored as NaN.
+"""
+
+import json
+import os
+
+# pylint: disable=E0611,F0401
+from numpy import arange, array, concatenate, empty, float64, memmap, nan, \
+                  prod
+
+_FIELDS = {'eval': ('x', 'f', 'g', 'fail', 'time'),
+           'grad': ('x', 'df', 'dg', 'fail', 'time')}
+_RESULTS = ('f', 'g', 'df', 'dg')
+
+
+def _run_dirs(directory):
+    """ Returns the run directories in `directory`, oldest first."""
+
+    if not os.path.isdir(directory):
+        return []
+
+    runs = [name for name in os.listdir(directory)
+            if name.startswith('run_') and
+            os.path.isfile(os.path.join(directory, name, 'index.json'))]
+    return [os.path.join(directory, name) for name in sorted(runs)]
+
+
+def _shapes(nparam, nobj, ncon):
+    """ Returns the shape of one record of each field of each stream."""
+
+    return {'eval': {'x': (nparam,), 'f': (nobj,), 'g': (ncon,),
+                     'fail': (), 'time': ()},
+            'grad': {'x': (nparam,), 'df': (nobj, nparam),
+                     'dg': (ncon, nparam), 'fail': (), 'time': ()}}
+
+
+def _chunk_file(path, stream, number, field):
+    """ Returns the name of a chunk file."""
+
+    return os.path.join(path, '%s_%06d_%s.bin' % (stream, number, field))
+
+
+class HistoryWriter(object):
+    """ Appends driver evaluations to a new run in `directory`.
+
+    directory: str
+        History directory. It is created if needed.
+
+    nparam, nobj, ncon: int
+        Number of scalar design variables, objectives and constraints.
+
+    chunk_size: int
+        Number of calls written to each chunk.
+    """
+
+    def __init__(self, directory, nparam, nobj, ncon, chunk_size=1000):
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        runs = _run_dirs(directory)
+        if runs:
+            number = int(os.path.basename(runs[-1])[4:]) + 1
+        else:
+            number = 0
+        self.path = os.path.join(directory, 'run_%04d' % number)
+        os.mkdir(self.path)
+
+        self.chunk_size = chunk_size
+        self._index = {'nparam': nparam, 'nobj': nobj, 'ncon': ncon,
+                       'chunks': {'eval': [], 'grad': []}}
+        self._shapes = _shapes(nparam, nobj, ncon)
+        self._files = {'eval': None, 'grad': None}
+        self._counts = {'eval': 0, 'grad': 0}
+        self._write_index()
+
+    def record_eval(self, x, f, g, fail, elapsed):
+        """ Appends one objfunc call."""
+
+        self._append('eval', (x, f, g, fail, elapsed))
+
+    def record_grad(self, x, df, dg, fail, elapsed):
+        """ Appends one gradfunc call."""
+
+        self._append('grad', (x, df, dg, fail, elapsed))
+
+    def flush(self):
+        """ Ends the chunks being written, so that the index lists every
+        call."""
+
+        for stream in ('eval', 'grad'):
+            if self._files[stream] is not None:
+                self._end_chunk(stream)
+        self._write_index()
+
+    def close(self):
+        """ Ends the chunks being written and updates the index."""
+
+        self.flush()
+
+    def _append(self, stream, record):
+        """ Writes a record to the end of the current chunk of `stream`, and
+        ends the chunk once it is full."""
+
+        files = self._files[stream]
+        if files is None:
+            number = len(self._index['chunks'][stream])
+            files = [open(_chunk_file(self.path, stream, number, field), 'ab')
+                     for field in _FIELDS[stream]]
+            self._files[stream] = files
+
+        shapes = self._shapes[stream]
+        for i, field in enumerate(_FIELDS[stream]):
+            data = empty(shapes[field])
+            value = record[i]
+            if record[3] and field in _RESULTS:
+                data[...] = nan
+            elif hasattr(value, 'toarray'):
+                # Sparse Jacobians are stored dense.
+                data[...] = value.toarray()
+            else:
+                data[...] = value
+            files[i].write(data.tostring())
+            files[i].flush()
+
+        self._counts[stream] += 1
+        if self._counts[stream] >= self.chunk_size:
+            self._end_chunk(stream)
+            self._write_index()
+
+    def _end_chunk(self, stream):
+        """ Closes the current chunk of `stream` and adds it to the index."""
+
+        for stream_file in self._files[stream]:
+            stream_file.close()
+        self._files[stream] = None
+
+        chunks = self._index['chunks'][stream]
+        start = chunks[-1][1] if chunks else 0
+        chunks.append((start, start + self._counts[stream]))
+        self._counts[stream] = 0
+
+    def _write_index(self):
+        """ Replaces the index file."""
+
+        name = os.path.join(self.path, 'index.json')
+        tmp = name + '.tmp'
+        with open(tmp, 'w') as stream:
+            json.dump(self._index, stream)
+        if os.path.exists(name):
+            os.remove(name)
+        os.rename(tmp, name)
+
+
+class HistoryReader(object):
+    """ Reads a run written by HistoryWriter.
+
+    directory: str
+        History directory.
+
+    run: int
+        Which run to read, counting like a Python list index. The default
+        is the most recent run.
+    """
+
+    def __init__(self, directory, run=-1):
+
+        runs = _run_dirs(directory)
+        if not runs:
+            raise IOError("No optimization history found in '%s'" % directory)
+        self.path = runs[run]
+
+        with open(os.path.join(self.path, 'index.json')) as stream:
+            index = json.load(stream)
+
+        self.nparam = index['nparam']
+        self.nobj = index['nobj']
+        self.ncon = index['ncon']
+        self._shapes = _shapes(self.nparam, self.nobj, self.ncon)
+        self._chunks = index['chunks']
+
+        # A run whose writer wasn't closed ends with a chunk that isn't in
+        # the index yet.
+        for stream, chunks in self._chunks.iteritems():
+            count = self._open_count(stream, len(chunks))
+            if count > 0:
+                start = chunks[-1][1] if chunks else 0
+                chunks.append((start, start + count))
+
+    def _open_count(self, stream, number):
+        """ Returns the number of complete records in chunk `number` of
+        `stream`, judging by the size of its files. A record cut short by
+        a crash isn't counted."""
+
+        count = None
+        for field in _FIELDS[stream]:
+            size = 8*int(prod(self._shapes[stream][field]))
+            if size == 0:
+                continue
+            name = _chunk_file(self.path, stream, number, field)
+            if not os.path.isfile(name):
+                return 0
+            records = os.path.getsize(name) // size
+            count = records if count is None else min(count, records)
+        return count or 0
+
+    def num_evals(self):
+        """ Returns the number of objfunc calls stored."""
+
+        chunks = self._chunks['eval']
+        return chunks[-1][1] if chunks else 0
+
+    def num_grads(self):
+        """ Returns the number of gradfunc calls stored."""
+
+        chunks = self._chunks['grad']
+        return chunks[-1][1] if chunks else 0
+
+    def evals(self, start=0, stop=None):
+        """ Returns a dict of arrays ('x', 'f', 'g', 'fail', 'time') for
+        objfunc calls `start` through `stop`-1."""
+
+        return self._read('eval', start, stop)
+
+    def grads(self, start=0, stop=None):
+        """ Returns a dict of arrays ('x', 'df', 'dg', 'fail', 'time') for
+        gradfunc calls `start` through `stop`-1."""
+
+        return self._read('grad', start, stop)
+
+    def _read(self, stream, start, stop):
+        """ Collects a slice of `stream` from the chunks that overlap it."""
+
+        chunks = self._chunks[stream]
+        total = chunks[-1][1] if chunks else 0
+        start, stop, _ = slice(start, stop).indices(total)
+
+        parts = dict((field, []) for field in _FIELDS[stream])
+        for number, (first, last) in enumerate(chunks):
+            if last <= start or first >= stop:
+                continue
+            lo = max(start, first) - first
+            hi = min(stop, last) - first
+            for field in _FIELDS[stream]:
+                shape = (last - first,) + self._shapes[stream][field]
+                if prod(shape) == 0:
+                    data = empty(shape)
+                else:
+                    data = memmap(_chunk_file(self.path, stream, number,
+                                              field),
+                                  dtype=float64, mode='r', shape=shape)
+                parts[field].append(data[lo:hi])
+
+        result = {}
+        for field, data in parts.iteritems():
+            if len(data) == 1:
+                result[field] = data[0]
+            elif data:
+                result[field] = concatenate(data)
+            else:
+                result[field] = array([])
+        result['iteration'] = arange(start, max(start, stop))
+        return result
+
+
+class HistoryReplay(object):
+    """ Serves calls from a recorded run for as long as the optimizer asks
+    for the same design points, in the same order, as it did when the run
+    was recorded.
+
+    reader: HistoryReader
+        Recorded run to replay.
+
+    tol: float
+        Largest difference in any design variable for a point to count as
+        the recorded one.
+
+    block: int
+        Number of calls read from disk at a time.
+    """
+
+    def __init__(self, reader, tol, block=1000):
+
+        self.reader = reader
+        self.tol = tol
+        self.block = block
+        self.active = True
+        self.replayed = {'eval': 0, 'grad': 0}
+
+        self._totals = {'eval': reader.num_evals(),
+                        'grad': reader.num_grads()}
+        self._blocks = {'eval': None, 'grad': None}
+
+    def next_eval(self, x):
+        """ Returns the recorded `(f, g, fail)` for the next objfunc call if
+        it was made at `x`, otherwise stops the replay and returns None."""
+
+        record = self._next('eval', x)
+        if record is None:
+            return None
+
+        if record['fail']:
+            return [], [], 1
+        return array(record['f']), array(record['g']), 0
+
+    def next_grad(self, x):
+        """ Returns the recorded `(df, dg, fail)` for the next gradfunc call
+        if it was made at `x`, otherwise stops the replay and returns None."""
+
+        record = self._next('grad', x)
+        if record is None:
+            return None
+
+        if record['fail']:
+            return [], [], 1
+        return array(record['df']), array(record['dg']), 0
+
+    def _next(self, stream, x):
+        """ Returns the next record of `stream` as a dict if it matches `x`.
+        """
+
+        if not self.active:
+            return None
+
+        count = self.replayed[stream]
+        if count >= self._totals[stream]:
+            self.active = False
+            return None
+
+        block = self._blocks[stream]
+        if block is None or count >= block['iteration'][-1] + 1:
+            block = self._read(stream, count)
+            self._blocks[stream] = block
+        i = count - block['iteration'][0]
+
+        recorded = block['x'][i]
+        if len(recorded) != len(x) or abs(recorded - x).max() > self.tol:
+            self.active = False
+            return None
+
+        self.replayed[stream] += 1
+        return dict((field, block[field][i]) for field in block)
+
+    def _read(self, stream, start):
+        """ Loads the block of `stream` that starts at `start`."""
+
+        if stream == 'eval':
+            return self.reader.evals(start, start + self.block)
+        return self.reader.grads(start, start + self.block)
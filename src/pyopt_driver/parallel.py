@@ -0,0 +1,82 @@
+"""
+Process pool used by the pyOpt driver to evaluate several design points at
+once.
+
+Each worker process holds its own copy of the driver and its workflow. On
+POSIX systems the copy comes for free when the worker is forked; elsewhere
+the driver is pickled into the worker when it starts.
+"""
+
+import multiprocessing
+
+_WORKER_DRIVER = None
+
+
+def _init_worker(driver):
+    """ Stores this worker's copy of the driver."""
+
+    global _WORKER_DRIVER
+    _WORKER_DRIVER = driver
+
+    # A worker evaluates everything it is given itself.
+    driver._workers = 1
+
+
+def _evaluate_indexed(item):
+    """ Evaluates the design point in an `(index, x)` pair and returns the
+    index with the result, so that results can come back in any order."""
+
+    i, x = item
+    try:
+        return i, _WORKER_DRIVER._evaluate_point(x)
+    except Exception as err:
+        print "Exception in evaluation worker: %s" % str(err)
+        return i, ([], [], 1)
+
+
+def _optimize_indexed(item):
+    """ Runs an optimization from the starting point in an `(index, x0)`
+    pair on this worker's copy of the driver."""
+
+    i, x0 = item
+    return i, _WORKER_DRIVER._optimize_from(x0)
+
+
+class EvaluationPool(object):
+    """ Pool of worker processes that evaluate design points for a driver.
+
+    driver: pyOptDriver
+        Driver whose model each worker copies. The driver's problem layout
+        must already be set up, since workers don't see later changes.
+
+    workers: int
+        Number of worker processes.
+    """
+
+    def __init__(self, driver, workers):
+
+        self.workers = workers
+        self._pool = multiprocessing.Pool(workers, _init_worker, (driver,))
+
+    def imap_unordered(self, xs):
+        """ Evaluates each design point in `xs` and yields `(i, (f, g, fail))`
+        for the i-th point as soon as it is done, so results come back in
+        the order they finish. At most one point per worker is in flight at
+        a time. A design whose evaluation can't be completed comes back with
+        `fail=1`; the others are unaffected."""
+
+        return self._pool.imap_unordered(_evaluate_indexed, enumerate(xs))
+
+    def optimize_unordered(self, starts):
+        """ Runs an independent optimization from each starting point in
+        `starts` and yields `(i, result)` for the i-th start as soon as it
+        finishes. `result` is the dict returned by the driver's
+        `_optimize_from`."""
+
+        return self._pool.imap_unordered(_optimize_indexed, enumerate(starts))
+
+    def close(self):
+        """ Shuts down the worker processes."""
+
+        self._pool.terminate()
+        self._pool.join()
@@ -5,13 +5,26 @@ pyOpt is an object-oriented framework for formulating and solving nonlinear
 constrained optimization problems.
 """
 
-# pylint: disable=E0611,F0401
-from numpy import array, float32, float64, int32, int64
+# The package and this module share a name, so without this, Python 2 would
+# look for pyopt_driver.cache and friends inside this module.
+from __future__ import absolute_import
+
+from copy import deepcopy
+import imp
+import json
+import os
+import sys
+import time
 
-from pyOpt import Optimization
+# pylint: disable=E0611,F0401
+from numpy import arange, array, asarray, concatenate, empty, float32, \
+                  float64, fromiter, int32, int64, iscomplexobj, ones, rint, \
+                  vstack, where, zeros
+from scipy.sparse import csr_matrix, issparse
 
 from openmdao.main.api import Driver
-from openmdao.main.datatypes.api import Bool, Dict, Enum, Str
+from openmdao.main.datatypes.api import Bool, Dict, Enum, Float, Int, List, \
+                                       Str
 from openmdao.main.interfaces import IHasParameters, IHasConstraints, \
                                      IHasObjective, implements, IOptimizer
 from openmdao.main.hasparameters import HasParameters
@@ -19,20 +32,100 @@ from openmdao.main.hasconstraints import HasConstraints
 from openmdao.main.hasobjective import HasObjectives
 from openmdao.util.decorators import add_delegate
 
+from pyopt_driver.cache import EvaluationCache
+from pyopt_driver.history import HistoryReader, HistoryReplay, \
+                                 HistoryWriter
+from pyopt_driver.parallel import EvaluationPool
+from pyopt_driver.sampling import latin_hypercube, sobol
+from pyopt_driver.stats import DriverStats, NullStats
+from pyopt_driver.surrogate import SurrogateScreen
+from pyopt_driver.watchdog import EvaluationTimeout, Watchdog
+
+# Importing pyOpt loads the compiled extension of every optimizer it has, so
+# we put that off until the driver runs. We still fail here if it's missing.
+try:
+    _PYOPT_PATH = imp.find_module('pyOpt')[1]
+except ImportError:
+    raise ImportError("pyOpt is not installed")
+
+_OPTIMIZERS = ['ALGENCIAN', 'ALHSO', 'ALPSO', 'COBYLA', 'CONMIN', 'FILTERSD',
+               'FSQP', 'GCMMA', 'KSOPT', 'MIDACO', 'MMA', 'MMFD', 'NLPQL',
+               'NLPQLP', 'NSGA2', 'PSQP', 'SDPEN', 'SLSQP', 'SNOPT', 'SOLVOPT']
+
+# Optimizers written in Python, which have no extension module to look for.
+_PURE_PYTHON = ['ALHSO', 'ALPSO']
+
+_EXTENSIONS = ('.so', '.pyd')
+
+_OPTIMIZER_CACHE = os.path.join(os.path.expanduser('~'), '.openmdao',
+                                'pyopt_driver_optimizers.json')
+
+
+def _has_optimizer(name):
+    """ Returns True if pyOpt's subpackage for optimizer `name` is present
+    and, unless it is pure Python, has been built. Nothing is imported."""
+
+    path = os.path.join(_PYOPT_PATH, 'py%s' % name)
+    try:
+        files = os.listdir(path)
+    except OSError:
+        return False
+
+    if 'py%s.py' % name not in files and 'py%s.pyc' % name not in files:
+        return False
+
+    if name in _PURE_PYTHON:
+        return True
+
+    return any(os.path.splitext(fname)[1] in _EXTENSIONS for fname in files)
+
 
 def _check_imports():
-    """ Dynamically remove optimizers we don't have
+    """ Dynamically remove optimizers we don't have. The answer is cached
+    on disk for each Python and pyOpt installation, and is worked out again
+    whenever an optimizer's directory changes.
     """
 
-    optlist = ['ALGENCIAN', 'ALHSO', 'ALPSO', 'COBYLA', 'CONMIN', 'FILTERSD',
-               'FSQP', 'GCMMA', 'KSOPT', 'MIDACO', 'MMA', 'MMFD', 'NLPQL', 'NLPQLP',
-               'NSGA2', 'PSQP', 'SDPEN', 'SLSQP', 'SNOPT', 'SOLVOPT']
-
-    for optimizer in optlist[:]:
+    stamps = []
+    for name in _OPTIMIZERS:
         try:
-            exec('from pyOpt import %s' % optimizer)
-        except ImportError:
-            optlist.remove(optimizer)
+            stamp = os.path.getmtime(os.path.join(_PYOPT_PATH, 'py%s' % name))
+        except OSError:
+            stamp = None
+        stamps.append((name, stamp))
+    key = repr((sys.executable, _PYOPT_PATH, stamps))
+
+    try:
+        with open(_OPTIMIZER_CACHE) as stream:
+            cache = json.load(stream)
+    except (IOError, ValueError):
+        cache = {}
+
+    if key in cache:
+        return cache[key]
+
+    optlist = [name for name in _OPTIMIZERS if _has_optimizer(name)]
+
+    # Not being able to write the cache just means we look again next time.
+    # It is written to a file of our own and renamed into place, so another
+    # process never reads a half-written cache.
+    cache[key] = optlist
+    tmp = '%s.%d.tmp' % (_OPTIMIZER_CACHE, os.getpid())
+    try:
+        directory = os.path.dirname(_OPTIMIZER_CACHE)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp, 'w') as stream:
+            json.dump(cache, stream)
+        # Only Windows refuses to rename over an existing file.
+        if os.name == 'nt' and os.path.exists(_OPTIMIZER_CACHE):
+            os.remove(_OPTIMIZER_CACHE)
+        os.rename(tmp, _OPTIMIZER_CACHE)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
 
     return optlist
 
@@ -50,6 +143,10 @@ class pyOptDriver(Driver):
                 desc='Title of this optimization run')
     options = Dict(iotype='in',
                    desc='Dictionary of optimization parameters')
+    optimizer_args = Dict(iotype='in',
+                          desc='Keyword arguments passed to the optimizer\'s '
+                               'constructor, such as pll_type for pyOpt\'s '
+                               'MPI parallel modes.')
     print_results = Bool(True, iotype='in',
                          desc='Print pyOpt results if True')
     pyopt_diff = Bool(False, iotype='in',
@@ -57,7 +154,162 @@ class pyOptDriver(Driver):
     store_hst = Bool(False, iotype='in',
                      desc='Store optimization history if True')
     hot_start = Bool(False, iotype='in',
-                     desc='resume optimization run using stored history if True')
+                     desc='resume optimization run using stored history if True.'
+                          ' If history_dir is set, the driver replays its own '
+                          'history instead of pyOpt\'s.')
+    hot_start_tol = Float(1e-10, iotype='in', low=0.0,
+                          desc='Largest difference in any design variable for '
+                               'a hot start request to match the history.')
+    fd_engine = Enum('pyOpt', ['pyOpt', 'driver'], iotype='in',
+                     desc="Finite difference engine used when pyopt_diff is "
+                          "True. 'driver' evaluates all perturbed points "
+                          "together, in parallel when parallel_workers > 1, "
+                          "using the step and form from gradient_options.")
+    history_dir = Str('', iotype='in',
+                      desc='Directory that every objfunc and gradfunc call is '
+                           'streamed to. Each run is stored separately. An '
+                           'empty string disables the history.')
+    history_chunk = Int(1000, iotype='in', low=1,
+                        desc='Number of calls written to each history chunk.')
+    jacobian_sparsity = Dict(iotype='in',
+                             desc='Dictionary mapping constraint names to '
+                                  'the list of parameter names each one '
+                                  'depends on. Constraints that are left '
+                                  'out depend on every parameter.')
+    detect_sparsity = Bool(False, iotype='in',
+                           desc='Take the constraint sparsity from the '
+                                'nonzeros of full Jacobians at several '
+                                'points, unless jacobian_sparsity is given.')
+    sparsity_samples = Int(3, iotype='in', low=1,
+                           desc='Number of full Jacobians, at distinct '
+                                'points, whose nonzeros are combined before '
+                                'detected sparsity is used.')
+    sparsity_recheck = Int(10, iotype='in', low=0,
+                           desc='Once sparsity has been detected, every '
+                                'this many gradients is a full Jacobian '
+                                'again, and any new nonzeros are added to '
+                                'the pattern. 0 never rechecks.')
+    linear_constraints = List(Str, iotype='in',
+                              desc='Names of constraints that are linear in '
+                                   'the parameters. Their Jacobian rows are '
+                                   'calculated once per run and reused.')
+    detect_linear = Bool(False, iotype='in',
+                         desc='Treat constraints whose Jacobian rows are the '
+                              'same at the first two gradient points, with '
+                              'every parameter they depend on changed, as '
+                              'linear.')
+    linear_recheck = Int(10, iotype='in', low=0,
+                         desc='Once constraints have been detected as '
+                              'linear, every this many gradients includes '
+                              'their rows again, and any whose rows have '
+                              'changed are no longer treated as linear. 0 '
+                              'never rechecks.')
+    active_set = Bool(False, iotype='in',
+                      desc='Only differentiate the equality constraints and '
+                           'the inequality constraints that are active or '
+                           'nearly so at the point pyOpt asks for. Rows of '
+                           'the other constraints are zero.')
+    active_tol = Float(1e-3, iotype='in', low=0.0,
+                       desc='An inequality constraint counts as active for '
+                            'active_set once its value is above -active_tol.')
+    incremental = Bool(True, iotype='in',
+                       desc='Only set the parameters that differ from the '
+                            'last evaluated point, so that components that '
+                            'do not depend on them stay valid and are not '
+                            'run again.')
+    eval_timeout = Float(0.0, iotype='in', low=0.0,
+                         desc='Wall-clock limit in seconds on each model '
+                              'evaluation. An evaluation that runs over is '
+                              'abandoned and reported to pyOpt as failed. 0 '
+                              'disables the watchdog.')
+    timeout_policy = Enum('fail', ['fail', 'retry', 'blacklist'], iotype='in',
+                          desc="What happens after a timeout: 'fail' reports "
+                               "the failure, 'retry' runs the evaluation once "
+                               "more first, and 'blacklist' also fails every "
+                               "later request for the same point, to within "
+                               "cache_tol, without running the model.")
+    cache_size = Int(0, iotype='in', low=0,
+                     desc='Maximum number of evaluations to keep in the '
+                          'evaluation cache. 0 disables the cache.')
+    cache_tol = Float(1e-12, iotype='in', low=0.0,
+                      desc='Design vectors that differ by less than this are '
+                           'treated as the same point by the evaluation cache.')
+
+    parallel_workers = Int(1, iotype='in', low=1,
+                           desc='Number of worker processes used by '
+                                'evaluate_population and multi_start. The '
+                                'workers are only started when a batch of '
+                                'points is first evaluated. pyOpt\'s own '
+                                'population optimizers never use them. 1 '
+                                'evaluates serially on this workflow.')
+
+    restore_best = Bool(False, iotype='in',
+                        desc='Snapshot the model at the best feasible point '
+                             'found, and restore that snapshot after the run '
+                             'instead of re-running the model at the solution.')
+    feasibility_tol = Float(1e-6, iotype='in', low=0.0,
+                            desc='Constraint violation allowed for a point to '
+                                 'count as feasible for restore_best.')
+
+    multi_start = Int(0, iotype='in', low=0,
+                      desc='Number of independent optimizations to run from '
+                           'sampled starting points before the main run, '
+                           'which then starts from the best of them. 0 '
+                           'disables multi-start.')
+    start_sampling = Enum('lhs', ['lhs', 'sobol'], iotype='in',
+                          desc="How the multi-start points are sampled within "
+                               "the parameter bounds: 'lhs' (Latin hypercube) "
+                               "or 'sobol'.")
+    start_seed = Int(0, iotype='in',
+                     desc='Seed for the Latin hypercube sample of starting '
+                          'points.')
+
+    surrogate = Bool(False, iotype='in',
+                     desc='Screen each candidate with a radial basis '
+                          'function surrogate trained on the real '
+                          'evaluations, and answer those predicted to be '
+                          'clearly worse with the prediction instead of '
+                          'running the model. Meant for population '
+                          'optimizers such as ALPSO, ALHSO and NSGA2.')
+    surrogate_min_points = Int(20, iotype='in', low=1,
+                               desc='Number of real evaluations before the '
+                                    'surrogate is used.')
+    surrogate_refresh = Int(10, iotype='in', low=1,
+                            desc='Refit the surrogate after this many new '
+                                 'real evaluations.')
+    surrogate_radius = Float(0.1, iotype='in', low=0.0,
+                             desc='Candidates further than this from every '
+                                  'real evaluation, with the parameters '
+                                  'scaled to their bounds, are always run.')
+    surrogate_margin = Float(0.1, iotype='in', low=0.0,
+                             desc='Fraction of the observed objective and '
+                                  'constraint ranges by which a prediction '
+                                  'has to be worse for the candidate to be '
+                                  'skipped.')
+
+    collect_stats = Bool(False, iotype='in',
+                         desc='Time each phase of the run and keep the '
+                              'results in the stats attribute.')
+    profile_slowest = Int(0, iotype='in', low=0,
+                          desc='With collect_stats, run every model '
+                               'evaluation under cProfile and keep the '
+                               'profiles of this many of the slowest.')
+
+    derivative_direction = Str('', iotype='out',
+                               desc="Mode ('forward' or 'adjoint') used for "
+                                    "the most recent gradient.")
+    true_evals = Int(0, iotype='out',
+                     desc='Number of candidates the surrogate sent to the '
+                          'model.')
+    surrogate_evals = Int(0, iotype='out',
+                          desc='Number of candidates answered by the '
+                               'surrogate.')
+    timeouts = Int(0, iotype='out',
+                   desc='Number of evaluations that ran over eval_timeout.')
+    cache_hits = Int(0, iotype='out',
+                     desc='Number of evaluations served from the cache.')
+    cache_misses = Int(0, iotype='out',
+                       desc='Number of evaluations that ran the model.')
 
     def __init__(self):
         """Initialize pyopt - not much needed."""
@@ -65,20 +317,391 @@ class pyOptDriver(Driver):
         super(pyOptDriver, self).__init__()
 
         self.pyOpt_solution = None
+        self.local_optima = []
+        self.stats = None
+        self.stats_callback = None
         self.param_type = {}
         self.nparam = None
+        self._int_idx = array([], dtype=int)
 
         self.inputs = None
         self.objs = None
         self.cons = None
 
+        self._cache = EvaluationCache()
+        self._jac_cache = EvaluationCache()
+        self._blacklist = EvaluationCache()
+        self._timeouts = 0
+        self._model_x = None
+        self._initial = None
+        self._best = None
+        self._neq = 0
+        self._ncon = 0
+        self._fbuf = empty(0)
+        self._gbuf = empty(0)
+        self._con_slices = []
+        self._sparsity = None
+        self._pattern = None
+        self._pattern_x = None
+        self._pattern_points = 0
+        self._pattern_calls = 0
+        self._linear = {}
+        self._linear_rows = None
+        self._linear_probe = None
+        self._linear_detected = set()
+        self._linear_calls = 0
+        self._pool = None
+        self._workers = 1
+        self._history = None
+        self._replay = None
+        self._stats = NullStats()
+        self._phase_prefix = ''
+        self._surrogate = None
+
+        self._opt_prob = None
+        self._layout = None
+
     def execute(self):
         """pyOpt execution. Note that pyOpt controls the execution, and the
         individual optimizers control the iteration."""
 
         self.pyOpt_solution = None
+        self.stats = None
+        self.true_evals = 0
+        self.surrogate_evals = 0
 
-        self.run_iteration()
+        if self.collect_stats:
+            self._stats = DriverStats(self.profile_slowest,
+                                      self.stats_callback)
+        else:
+            self._stats = NullStats()
+        stats = self._stats
+
+        # Other inputs to the model may have changed since the last run, so
+        # we never carry cached evaluations over.
+        self._cache = EvaluationCache(self.cache_size, self.cache_tol)
+        self._jac_cache = EvaluationCache(self.cache_size, self.cache_tol)
+        self._blacklist = EvaluationCache(sys.maxint, self.cache_tol)
+        self._timeouts = 0
+        self._model_x = None
+        self._best = None
+        self._surrogate = None
+
+        with stats.timer('initial_run'):
+            self.run_iteration()
+
+        # The problem layout is only rebuilt when parameters, objectives or
+        # constraints have changed since the last run.
+        with stats.timer('setup'):
+            if self._opt_prob is None:
+                self._setup_problem()
+            else:
+                self._refresh_problem()
+        opt_prob = self._opt_prob
+
+        # Declared constraint sparsity is grouped once per run. Detected
+        # sparsity is gathered again from the full gradients of each run.
+        if self.jacobian_sparsity:
+            self._sparsity = self._build_sparsity(self.jacobian_sparsity)
+        else:
+            self._sparsity = None
+        self._pattern = None
+        self._pattern_x = None
+        self._pattern_points = 0
+        self._pattern_calls = 0
+
+        # Rows of linear constraints are calculated once, here for those
+        # that are declared, and after the second gradient for those that
+        # are detected.
+        self._linear = {}
+        self._linear_rows = None
+        self._linear_probe = None
+        self._linear_detected = set()
+        self._linear_calls = 0
+        if self.linear_constraints and not self.pyopt_diff:
+            with stats.timer('linear_jacobian'):
+                self._set_linear(
+                    self._constraint_positions(self.linear_constraints))
+
+        # Most optimizers start by evaluating the initial point, which the
+        # run above has just done, so hold on to its outputs for objfunc.
+        x0 = self.eval_parameters(self.parent)
+        self._initial = (x0,) + self._eval_outputs()
+        self._model_x = x0
+
+        opt = self._make_optimizer()
+
+        # In multi-start mode, the independent runs happen first, and the
+        # main run below starts from the best of their solutions.
+        self.local_optima = []
+        if self.multi_start > 0:
+            with stats.timer('multi_start'):
+                self._run_starts()
+
+        # With our own history, we hot start by replaying it, and pyOpt
+        # doesn't need to know.
+        hot_start = self.hot_start
+        self._replay = None
+        if hot_start and self.history_dir:
+            hot_start = False
+            try:
+                reader = HistoryReader(self.history_dir)
+            except IOError:
+                print "No history in '%s' to hot start from." % \
+                      self.history_dir
+            else:
+                self._replay = HistoryReplay(reader, self.hot_start_tol,
+                                             self.history_chunk)
+
+        if self.history_dir:
+            self._history = HistoryWriter(self.history_dir, self.nparam,
+                                          len(self.objs), self._ncon,
+                                          self.history_chunk)
+
+        if self.surrogate:
+            low, high = self._bounds()
+            self._surrogate = SurrogateScreen(low, high, self._neq,
+                                              self.surrogate_min_points,
+                                              self.surrogate_refresh,
+                                              self.surrogate_radius,
+                                              self.surrogate_margin,
+                                              self.feasibility_tol)
+
+        # pyOpt's optimizers evaluate one point at a time through objfunc,
+        # so the worker pool is only started by the first batch that needs
+        # it.
+        self._workers = self.parallel_workers
+
+        # Execute the optimization problem
+        start = time.time()
+        try:
+            self._call_optimizer(opt, self.store_hst, hot_start)
+        finally:
+            stats.record('optimizer', time.time() - start)
+            self._workers = 1
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+            if self._history is not None:
+                self._history.close()
+                self._history = None
+
+        self.cache_hits = self._cache.hits
+        self.cache_misses = self._cache.misses
+        self.timeouts = self._timeouts
+        if self._surrogate is not None:
+            self.true_evals = self._surrogate.true_evals
+            self.surrogate_evals = self._surrogate.surrogate_evals
+            self._surrogate = None
+
+        solution = opt_prob.solution(0)
+
+        # Print results
+        if self.print_results:
+            print solution
+            if self.cache_size > 0:
+                print "Evaluation cache: %d hits, %d misses" % \
+                      (self.cache_hits, self.cache_misses)
+            if self.timeouts > 0:
+                print "Evaluations timed out: %d" % self.timeouts
+            if self.surrogate:
+                print "Surrogate: %d real evaluations, %d predicted" % \
+                      (self.true_evals, self.surrogate_evals)
+            if self._replay is not None:
+                print "Hot start: replayed %d evaluations and %d gradients" % \
+                      (self._replay.replayed['eval'],
+                       self._replay.replayed['grad'])
+        self._replay = None
+
+        # Pull optimal parameters back into framework and re-run, so that
+        # framework is left in the right final state.
+        with stats.timer('extract_solution'):
+            x_opt = self._solution_vector(solution)
+        best = self._best
+        self._initial = None
+        self._best = None
+
+        with stats.timer('final_run'):
+            self._final_run(x_opt, best)
+
+        # Save the most recent solution.
+        self.pyOpt_solution = solution
+
+        if self.collect_stats:
+            self.stats = stats
+            if self.print_results:
+                print stats.report()
+        self._stats = NullStats()
+
+    def _make_optimizer(self):
+        """ Returns an instance of the requested optimizer with our options
+        set."""
+
+        # Instantiate the requested optimizer
+        optimizer = self.optimizer
+        try:
+            exec('from pyOpt import %s' % optimizer)
+        except ImportError:
+            msg = "Optimizer %s is not available in this installation." % \
+                   optimizer
+            self.raise_exception(msg, ImportError)
+
+        optname = vars()[optimizer]
+        opt = optname(**self.optimizer_args)
+
+        # Set optimization options
+        for option, value in self.options.iteritems():
+            opt.setOption(option, value)
+
+        return opt
+
+    def _call_optimizer(self, opt, store_hst, hot_start):
+        """ Runs `opt` on our pyOpt problem with the requested source of
+        gradients."""
+
+        opt_prob = self._opt_prob
+        if self.pyopt_diff and self.fd_engine == 'driver':
+            # Finite difference in the driver, all points at once
+            opt(opt_prob, sens_type=self.fdfunc, store_hst=store_hst,
+                hot_start=hot_start)
+        elif self.pyopt_diff:
+            # Use pyOpt's internal finite difference
+            opt(opt_prob, sens_type='FD',
+                sens_step=self.gradient_options.fd_step,
+                store_hst=store_hst, hot_start=hot_start)
+        else:
+            # Use OpenMDAO's differentiator for the gradient
+            opt(opt_prob, sens_type=self.gradfunc, store_hst=store_hst,
+                hot_start=hot_start)
+
+    def _bounds(self):
+        """ Returns arrays of the lower and upper bounds of every scalar
+        design variable."""
+
+        low = empty(self.nparam)
+        high = empty(self.nparam)
+        params = self.get_parameters()
+        for name, vartype, offset, size, choices in self._layout:
+            param = params[name]
+            low[offset:offset + size] = param.get_low()
+            high[offset:offset + size] = param.get_high()
+
+        return low, high
+
+    def _sample_starts(self):
+        """ Returns `multi_start` starting points spread over the parameter
+        bounds, one row per point. Discrete parameters keep their current
+        values, and integer parameters are rounded."""
+
+        low, high = self._bounds()
+
+        if self.start_sampling == 'sobol':
+            starts = sobol(self.multi_start, low, high)
+        else:
+            starts = latin_hypercube(self.multi_start, low, high,
+                                     self.start_seed)
+
+        variables = self._opt_prob._variables
+        for name, vartype, offset, size, choices in self._layout:
+            if vartype == 'd':
+                for i in range(offset, offset + size):
+                    starts[:, i] = variables[i].value
+            elif vartype == 'i':
+                starts[:, offset:offset + size] = \
+                    rint(starts[:, offset:offset + size])
+
+        return starts
+
+    def _run_starts(self):
+        """ Runs an independent optimization from each of `multi_start`
+        sampled points, on the worker pool when `parallel_workers` is
+        greater than 1. The local optima are kept in `local_optima`, best
+        first, and the pyOpt problem is left starting from the best one."""
+
+        starts = self._sample_starts()
+
+        if self.parallel_workers > 1:
+            pool = EvaluationPool(self, self.parallel_workers)
+            try:
+                results = [result for _, result in
+                           pool.optimize_unordered(starts)]
+            finally:
+                pool.close()
+        else:
+            # These calls happen outside the main optimizer's timer, so they
+            # are kept out of the objfunc and gradfunc phases.
+            self._phase_prefix = 'multi_start_'
+            try:
+                results = [self._optimize_from(x0) for x0 in starts]
+            finally:
+                self._phase_prefix = ''
+
+        # Feasible points come first, then the lowest first objective.
+        optima = [result for result in results if result['fail'] == 0]
+        optima.sort(key=lambda result: (not result['feasible'],
+                                        result['f'][0]))
+        self.local_optima = optima
+
+        if self.print_results:
+            print "Multi-start: %d of %d runs finished" % \
+                  (len(optima), len(starts))
+
+        if optima:
+            variables = self._opt_prob._variables
+            for i, value in enumerate(optima[0]['x']):
+                var = variables[i]
+                if var.type == 'c':
+                    var.value = float(value)
+                elif var.type == 'i':
+                    var.value = int(round(value))
+
+    def _optimize_from(self, x0):
+        """ Runs one optimization of our pyOpt problem starting from `x0`
+        and returns a dict with the start `x0`, the solution `x`, its
+        objectives `f` and constraints `g`, whether it is `feasible`, and
+        the `fail` flag of its evaluation."""
+
+        result = {'x0': array(x0), 'x': array(x0), 'f': [], 'g': [],
+                  'feasible': False, 'fail': 1}
+
+        opt_prob = self._opt_prob
+        variables = opt_prob._variables
+        saved = [variables[i].value for i in range(self.nparam)]
+        try:
+            for i, value in enumerate(x0):
+                var = variables[i]
+                if var.type == 'c':
+                    var.value = float(value)
+                elif var.type == 'i':
+                    var.value = int(round(value))
+
+            before = set(opt_prob.getSolSet().keys())
+            self._call_optimizer(self._make_optimizer(), False, False)
+            x = None
+            for key in set(opt_prob.getSolSet().keys()) - before:
+                x = self._solution_vector(opt_prob.solution(key))
+                opt_prob.delSol(key)
+            if x is None:
+                raise RuntimeError('the optimizer returned no solution')
+
+            f, g, fail = self._objfunc(x)
+            result.update(x=x, f=f, g=g, fail=fail,
+                          feasible=not fail and self._is_feasible(g))
+
+        except Exception as msg:
+            print "Exception in multi-start run from %s: %s" % (x0, str(msg))
+
+        finally:
+            for i, value in enumerate(saved):
+                variables[i].value = value
+
+        return result
+
+    def _setup_problem(self):
+        """ Builds the pyOpt Optimization object and the variable layout
+        from the current parameters, objectives, and constraints."""
+
+        from pyOpt import Optimization
 
         opt_prob = Optimization(self.title, self.objfunc, var_set={},
                                 obj_set={}, con_set={})
@@ -86,6 +709,9 @@ class pyOptDriver(Driver):
         # Add all parameters
         self.param_type = {}
         self.nparam = self.total_parameters()
+        int_idx = []
+        layout = []
+        offset = 0
         for name, param in self.get_parameters().iteritems():
 
             # We need to identify Enums, Lists, Dicts
@@ -112,13 +738,33 @@ class pyOptDriver(Driver):
                 self.raise_exception(msg, ValueError)
             self.param_type[name] = vartype
 
-            names = param.names
+            # Keep the scalar offsets of integer parameters, so that objfunc
+            # can round them all at once.
+            if vartype == 'i':
+                int_idx.extend(range(offset, offset + param.size))
+            layout.append((name, vartype, offset, param.size, choices))
+            offset += param.size
+
+            # Array parameters are added as one group with vectors of
+            # bounds and values. pyOpt would split a list of choices between
+            # the members of a group, so discrete ones are added one by one.
             lower_bounds = param.get_low()
             upper_bounds = param.get_high()
-            for i in range(param.size):
-                opt_prob.addVar(names[i], vartype,
-                                lower=lower_bounds[i], upper=upper_bounds[i],
-                                value=values[i], choices=choices)
+            if param.size > 1 and vartype != 'd':
+                opt_prob.addVarGroup(name, param.size, vartype,
+                                     value=array(values),
+                                     lower=array(lower_bounds),
+                                     upper=array(upper_bounds))
+            else:
+                names = param.names
+                for i in range(param.size):
+                    opt_prob.addVar(names[i], vartype,
+                                    lower=lower_bounds[i],
+                                    upper=upper_bounds[i],
+                                    value=values[i], choices=choices)
+
+        self._int_idx = array(int_idx, dtype=int)
+
         # Add all objectives
         for name in self.get_objectives():
             opt_prob.addObj(name)
@@ -126,16 +772,14 @@ class pyOptDriver(Driver):
         # Add all equality constraints
         for name, con in self.get_eq_constraints().items():
             if con.size > 1:
-                for i in range(con.size):
-                    opt_prob.addCon('%s [%s]' % (name, i), type='e')
+                opt_prob.addConGroup(name, con.size, type='e')
             else:
                 opt_prob.addCon(name, type='e')
 
         # Add all inequality constraints
         for name, con in self.get_ineq_constraints().items():
             if con.size > 1:
-                for i in range(con.size):
-                    opt_prob.addCon('%s [%s]' % (name, i), type='i')
+                opt_prob.addConGroup(name, con.size, type='i')
             else:
                 opt_prob.addCon(name, type='i')
 
@@ -143,54 +787,85 @@ class pyOptDriver(Driver):
         self.objs = self.list_objective_targets()
         self.cons = self.list_constraint_targets()
 
-        # Instantiate the requested optimizer
-        optimizer = self.optimizer
-        try:
-            exec('from pyOpt import %s' % optimizer)
-        except ImportError:
-            msg = "Optimizer %s is not available in this installation." % \
-                   optimizer
-            self.raise_exception(msg, ImportError)
-
-        optname = vars()[optimizer]
-        opt = optname()
-
-        # Set optimization options
-        for option, value in self.options.iteritems():
-            opt.setOption(option, value)
-
-        # Execute the optimization problem
-        if self.pyopt_diff:
-            # Use pyOpt's internal finite difference
-            opt(opt_prob, sens_type='FD', sens_step=self.gradient_options.fd_step,
-                store_hst=self.store_hst, hot_start=self.hot_start)
-        else:
-            # Use OpenMDAO's differentiator for the gradient
-            opt(opt_prob, sens_type=self.gradfunc, store_hst=self.store_hst,
-                hot_start=self.hot_start)
-
-        # Print results
-        if self.print_results:
-            print opt_prob.solution(0)
-
-        # Pull optimal parameters back into framework and re-run, so that
-        # framework is left in the right final state
-        dvals = []
-        for i in range(0, len(opt_prob.solution(0)._variables)):
-            dvals.append(opt_prob.solution(0)._variables[i].value)
-
-        # Integer parameters come back as floats, so we need to round them
-        # and turn them into python integers before setting.
-        if 'i' in self.param_type.values():
-            for j, param in enumerate(self.get_parameters().keys()):
-                if self.param_type[param] == 'i':
-                    dvals[j] = int(round(dvals[j]))
+        # Objectives and constraints are evaluated into these buffers, each
+        # constraint at its own offset, in the order pyOpt knows them.
+        self._con_slices = []
+        self._sparsity = None
+        offset = 0
+        for con in self.get_eq_constraints().values():
+            self._con_slices.append((con, offset, offset + con.size))
+            offset += con.size
+        self._neq = offset
+        for con in self.get_ineq_constraints().values():
+            self._con_slices.append((con, offset, offset + con.size))
+            offset += con.size
+        self._ncon = offset
+
+        self._fbuf = empty(len(self.get_objectives()))
+        self._gbuf = empty(self._ncon)
+
+        self._opt_prob = opt_prob
+        self._layout = layout
+
+    def _refresh_problem(self):
+        """ Updates the bounds and initial values in the existing pyOpt
+        Optimization object, and clears the solutions from the last run."""
+
+        opt_prob = self._opt_prob
+        opt_prob.name = self.title
+        for i in opt_prob.getSolSet().keys():
+            opt_prob.delSol(i)
+
+        variables = opt_prob._variables
+        params = self.get_parameters()
+        for name, vartype, offset, size, choices in self._layout:
+            param = params[name]
+            values = param.evaluate()
+            lower_bounds = param.get_low()
+            upper_bounds = param.get_high()
 
-        self.set_parameters(dvals)
-        self.run_iteration()
-
-        # Save the most recent solution.
-        self.pyOpt_solution = opt_prob.solution(0)
+            if vartype == 'd':
+                # Discrete variables are stored as an index into their
+                # choices, so let pyOpt rebuild them.
+                names = param.names
+                for i in range(size):
+                    opt_prob.setVar(offset + i, names[i], vartype,
+                                    lower=lower_bounds[i],
+                                    upper=upper_bounds[i],
+                                    value=values[i], choices=choices)
+                continue
+
+            convert = int if vartype == 'i' else float
+            for i in range(size):
+                var = variables[offset + i]
+                var.lower = convert(lower_bounds[i])
+                var.upper = convert(upper_bounds[i])
+                var.value = convert(values[i])
+
+    def __getstate__(self):
+        """ The cached pyOpt problem holds a reference to our bound objfunc,
+        so it isn't pickled. It is rebuilt on the next run. Run-time helpers
+        and statistics aren't pickled either."""
+
+        state = super(pyOptDriver, self).__getstate__()
+        state['_opt_prob'] = None
+        state['_layout'] = None
+        state['_pool'] = None
+        state['_history'] = None
+        state['_replay'] = None
+        state['_surrogate'] = None
+        state['stats_callback'] = None
+        state['stats'] = None
+        state['_stats'] = NullStats()
+        return state
+
+    def config_changed(self, update_parent=True):
+        """ Drops the cached problem layout whenever parameters, objectives
+        or constraints are added or removed."""
+
+        super(pyOptDriver, self).config_changed(update_parent)
+        self._opt_prob = None
+        self._layout = None
 
     def objfunc(self, x, *args, **kwargs):
         """ Function that evaluates and returns the objective function and
@@ -215,54 +890,209 @@ class pyOptDriver(Driver):
             1 for unsuccessful function evaluation
         """
 
+        # Note: Sometimes pyOpt sends us an x array that is larger than
+        # the number of parameters. In the pyOpt examples, they just take
+        # the first n entries as the parameters, so we do too.
+        x = array(x[0:self.nparam])
+
+        start = time.time()
+        f, g, fail = self._objfunc(x)
+        elapsed = time.time() - start
+        self._stats.record(self._phase_prefix + 'objfunc', elapsed)
+        if self._history is not None:
+            self._history.record_eval(x, f, g, fail, elapsed)
+
+        return f, g, fail
+
+    def _objfunc(self, x):
+        """ Returns the objectives, constraints, and failure flag at `x`,
+        taken from the initial run or the evaluation cache when possible."""
+
+        if self._replay is not None and self._replay.active:
+            # Hot start; the model isn't run while the optimizer retraces
+            # the recorded run.
+            result = self._replay.next_eval(x)
+            if result is not None:
+                return result
+
+        if self._initial is not None and self._model_is_at(self._initial[0]) \
+           and self._model_is_at(x):
+            # First request for the initial point; the model is still there.
+            f, g = self._initial[1:]
+            self._initial = None
+            self._cache.put(x, (f.copy(), g.copy()))
+            if self._surrogate is not None:
+                self._surrogate.add(x, f, g)
+            return f, g, 0
+
+        if len(self._blacklist) > 0 and self._blacklist.get(x) is not None:
+            # This point timed out before.
+            return [], [], 1
+
+        cached = self._cache.get(x)
+        if cached is not None:
+            # Note, the model is left wherever the last real evaluation put
+            # it. gradfunc checks for this.
+            f, g = cached
+            return f.copy(), g.copy(), 0
+
+        if self._surrogate is not None:
+            # Predictions are never cached, so a candidate that comes up
+            # again is screened again by the latest surrogate.
+            predicted = self._surrogate.screen(x)
+            if predicted is not None:
+                f, g = predicted
+                return f, g, 0
+
+        f, g, fail = self._stats.profile(x, self._evaluate_point, x)
+
+        if not fail:
+            self._cache.put(x, (f.copy(), g.copy()))
+            if self._surrogate is not None:
+                self._surrogate.add(x, f, g)
+            if self.restore_best:
+                self._update_best(x, f, g)
+
+        return f, g, fail
+
+    def evaluate_population(self, xs):
+        """ Evaluates several design points and returns a list of
+        `(f, g, fail)` tuples in the same order as `xs`. Points that aren't
+        in the evaluation cache are spread over `parallel_workers` worker
+        processes, each with its own copy of the workflow. A point that fails
+        only affects its own entry. This can only be called while the driver
+        is running.
+
+        xs: list of arrays
+            Design variables for each point
+        """
+
+        xs = [array(x[0:self.nparam]) for x in xs]
+
+        results = [None]*len(xs)
+        pending = []
+        for i, x in enumerate(xs):
+            if len(self._blacklist) > 0 and self._blacklist.get(x) is not None:
+                results[i] = ([], [], 1)
+                continue
+
+            cached = self._cache.get(x)
+            if cached is None:
+                pending.append(i)
+            else:
+                f, g = cached
+                results[i] = (f.copy(), g.copy(), 0)
+
+        if self._workers > 1 and len(pending) > 1:
+            evaluated = self._worker_pool().imap_unordered([xs[i] for i in
+                                                            pending])
+        else:
+            evaluated = ((j, self._evaluate_point(xs[i]))
+                         for j, i in enumerate(pending))
+
+        for j, result in evaluated:
+            i = pending[j]
+            f, g, fail = result
+            if not fail:
+                self._cache.put(xs[i], (f.copy(), g.copy()))
+            results[i] = result
+
+        return results
+
+    def _worker_pool(self):
+        """ Returns the worker pool, starting it on first use. Workers copy
+        the driver as it is when they start, which is after the problem
+        layout has been set up."""
+
+        if self._pool is None:
+            self._pool = EvaluationPool(self, self._workers)
+        return self._pool
+
+    def _evaluate_point(self, x):
+        """ Runs the model at `x` and returns the objectives, constraints
+        and failure flag."""
+
         fail = 1
         f = []
         g = []
 
-        try:
+        attempts = 2 if self.timeout_policy == 'retry' else 1
+        for attempt in range(attempts):
+            try:
 
-            # Note: Sometimes pyOpt sends us an x array that is larger than
-            # the number of parameters. In the pyOpt examples, they just take
-            # the first n entries as the parameters, so we do too.
-
-            # Integer parameters come back as floats, so we need to round them
-            # and turn them into python integers before setting.
-            param_types = self.param_type
-            if 'i' in param_types.values():
-                j = 0
-                for name, param in self.get_parameters().iteritems():
-                    size = param.size
-                    if param_types[name] == 'i':
-                        self.set_parameter_by_name(name, int(round(x[j:j+size])))
-                    else:
-                        self.set_parameter_by_name(name, x[j:j+size])
-                    j += size
-            else:
-                self.set_parameters(x[0:self.nparam])
+                with Watchdog(self.eval_timeout):
+                    self._run_model(x)
 
-            # Execute the model
-            self.run_iteration()
+                    # Get the objective function and constraint evaluations
+                    f, g = self._eval_outputs(complex if iscomplexobj(x)
+                                              else float)
 
-            # Get the objective function evaluations
-            f = array(self.eval_objectives())
+                fail = 0
 
-            # Get the constraint evaluations
-            g = array(self.eval_constraints(self.parent)).tolist()
+            except EvaluationTimeout as msg:
 
-            fail = 0
+                self._timed_out(x, msg)
 
-        except Exception as msg:
+                if attempt + 1 < attempts:
+                    continue
+                if self.timeout_policy == 'blacklist':
+                    self._blacklist.put(x, True)
 
-            # Exceptions seem to be swallowed by the C code, so this
-            # should give the user more info than the dreaded "segfault"
-            print "Exception: %s" % str(msg)
-            print 70*"="
-            import traceback
-            traceback.print_exc()
-            print 70*"="
+            except Exception as msg:
+
+                # Exceptions seem to be swallowed by the C code, so this
+                # should give the user more info than the dreaded "segfault"
+                print "Exception: %s" % str(msg)
+                print 70*"="
+                import traceback
+                traceback.print_exc()
+                print 70*"="
+
+            break
 
         return f, g, fail
 
+    def _timed_out(self, x, msg):
+        """ Records a run of the model at `x` that went over
+        `eval_timeout`."""
+
+        # The model was abandoned part way through, so it isn't at any known
+        # point.
+        self._model_x = None
+        self._timeouts += 1
+        self._stats.record('timeout', self.eval_timeout)
+        print "Timeout at %s: %s" % (x, str(msg))
+
+    def _eval_outputs(self, dtype=float):
+        """ Evaluates the objectives and constraints into their buffers and
+        returns copies of them. pyOpt may hold on to what we return (its own
+        finite difference keeps the base point's values), so the buffers
+        themselves are never handed out.
+
+        dtype: type
+            complex when the model has been run at a complex step, in which
+            case fresh complex arrays are filled instead of the float
+            buffers."""
+
+        if dtype is complex:
+            fbuf = empty(len(self._fbuf), dtype=complex)
+            gbuf = empty(len(self._gbuf), dtype=complex)
+        else:
+            fbuf = self._fbuf
+            gbuf = self._gbuf
+
+        with self._stats.timer('eval_objectives'):
+            fbuf[:] = self.eval_objectives()
+
+        with self._stats.timer('eval_constraints'):
+            scope = self.parent
+            for con, start, end in self._con_slices:
+                gbuf[start:end] = con.evaluate(scope)
+
+        if dtype is complex:
+            return fbuf, gbuf
+        return fbuf.copy(), gbuf.copy()
+
     def gradfunc(self, x, f, g, *args, **kwargs):
         """ Function that evaluates and returns the gradient of the objective
         function and constraints. This function is passed to pyOpt's
@@ -277,7 +1107,11 @@ class pyOptDriver(Driver):
 
         g: array
             Constraints evaluated at design variables
-            Note: unneeded in OpenMDAO, so unused
+            Note: only used to find the active constraints when
+            `active_set` is True
+
+        The model is only re-run if it isn't already sitting at `x`, under
+        the same `eval_timeout` as an evaluation, and Jacobians are cached per point when `cache_size` is nonzero.
 
         args and kwargs are also passed in, but aren't used.
 
@@ -294,12 +1128,557 @@ class pyOptDriver(Driver):
             1 for unsuccessful function evaluation
         """
 
+        x = array(x[0:self.nparam])
+
+        start = time.time()
+        df, dg, fail = self._gradfunc(x, g)
+        elapsed = time.time() - start
+        self._stats.record(self._phase_prefix + 'gradfunc', elapsed)
+        if self._history is not None:
+            self._history.record_grad(x, df, dg, fail, elapsed)
+
+        # None of pyOpt's optimizers take a sparse constraint gradient.
+        if issparse(dg):
+            dg = dg.toarray()
+
+        return df, dg, fail
+
+    def _gradfunc(self, x, g=None):
+        """ Returns the objective and constraint gradients and failure flag
+        at `x`, calculated by OpenMDAO. `g` holds the constraint values at
+        `x`, if they are known."""
+
+        fail = 1
+        df = []
+        dg = []
+
+        if self._replay is not None and self._replay.active:
+            result = self._replay.next_grad(x)
+            if result is not None:
+                return result
+
+        if len(self._blacklist) > 0 and self._blacklist.get(x) is not None:
+            return df, dg, fail
+
+        try:
+            cached = self._jac_cache.get(x)
+            if cached is not None:
+                df, dg = cached
+                return df.copy(), dg.copy(), 0
+
+            # pyOpt usually asks for the gradient at the point it just
+            # evaluated, but the evaluation cache or the optimizer itself may
+            # have left the model somewhere else. Only re-run if it has.
+            if not self._model_is_at(x):
+                with Watchdog(self.eval_timeout):
+                    self._run_model(x)
+
+            if self.active_set:
+                active = self._active_constraints(g)
+            else:
+                active = None
+
+            probing = self.detect_linear and self._linear_probe is not False
+            rechecking = not probing and self._linear_due()
+            linear = self._linear
+            if probing or rechecking:
+                # Linearity is judged from full gradients, so every
+                # constraint is differentiated then.
+                active = None
+                linear = {}
+            elif linear:
+                if active is None:
+                    active = set(range(len(self._con_slices)))
+                active = active - set(linear)
+
+            detecting = self.detect_sparsity and \
+                        not self.jacobian_sparsity and self._pattern_due(x)
+
+            if not detecting and \
+               (self._sparsity is not None or active is not None):
+                df, dg = self._sparse_gradient(active)
+                if linear:
+                    dg = dg + self._linear_rows
+            else:
+                J = self._calc_gradient(self.inputs, self.objs + self.cons,
+                                        self.nparam,
+                                        len(self._fbuf) + self._ncon)
+
+                nobj = len(self.objs)
+                df = J[0:nobj, :]
+                dg = J[nobj:, :]
+
+                if detecting:
+                    self._update_pattern(x, dg)
+
+            if probing:
+                self._probe_linear(x, dg)
+            elif rechecking:
+                self._recheck_linear(dg)
+
+            fail = 0
+
+            self._jac_cache.put(x, (df.copy(), dg.copy()))
+
+        except EvaluationTimeout as msg:
+
+            self._timed_out(x, msg)
+            if self.timeout_policy == 'blacklist':
+                self._blacklist.put(x, True)
+
+        except Exception as msg:
+
+            # Exceptions seem to be swallowed by the C code, so this
+            # should give the user more info than the dreaded "segfault"
+            print "Exception: %s" % str(msg)
+            print 70*"="
+            import traceback
+            traceback.print_exc()
+            print 70*"="
+
+        return df, dg, fail
+
+    def _calc_gradient(self, inputs, outputs, nin, nout):
+        """ Calls calc_gradient in adjoint mode when there are fewer scalar
+        outputs than inputs, and in forward mode otherwise, unless
+        `gradient_options.derivative_direction` asks for a particular mode.
+
+        nin, nout: int
+            Number of scalar inputs and outputs.
+        """
+
+        mode = self.gradient_options.derivative_direction
+        if mode == 'auto':
+            mode = 'adjoint' if nout < nin else 'forward'
+        self.derivative_direction = mode
+
+        with self._stats.timer('calc_gradient'):
+            return self.workflow.calc_gradient(inputs, outputs, mode=mode)
+
+    def _active_constraints(self, g):
+        """ Returns the set of positions in `_con_slices` of the equality
+        constraints and the inequality constraints within `active_tol` of
+        being violated, judging by the constraint values `g`. Returns None
+        if they all are, or if `g` doesn't hold every constraint."""
+
+        if g is None or len(g) < self._ncon:
+            return None
+
+        g = array(g[0:self._ncon]).real
+        tol = -self.active_tol
+        neq = self._neq
+
+        active = set()
+        for k, (con, start, end) in enumerate(self._con_slices):
+            if start < neq or (g[start:end] > tol).any():
+                active.add(k)
+
+        if len(active) == len(self._con_slices):
+            return None
+        return active
+
+    def _sparse_gradient(self, active=None):
+        """ Returns the objective gradient as an array and the constraint
+        gradient as a CSR matrix. Constraints that depend on the same
+        parameters are differentiated together, and only with respect to
+        those parameters. If `active` is given, only the constraints at
+        those positions in `_con_slices` are differentiated."""
+
+        df = self._calc_gradient(self.inputs, self.objs, self.nparam,
+                                 len(self._fbuf))
+
+        groups = self._sparsity
+        if groups is None:
+            groups = [(self.inputs, arange(self.nparam),
+                       range(len(self._con_slices)))]
+
+        rows = []
+        cols = []
+        vals = []
+        for inputs, columns, members in groups:
+            if active is not None:
+                members = [k for k in members if k in active]
+                if not members:
+                    continue
+
+            cons = [self.cons[k] for k in members]
+            con_rows = concatenate([arange(self._con_slices[k][1],
+                                           self._con_slices[k][2])
+                                    for k in members])
+
+            J = self._calc_gradient(inputs, cons, len(columns), len(con_rows))
+            i, j = J.nonzero()
+            rows.append(con_rows[i])
+            cols.append(columns[j])
+            vals.append(J[i, j])
+
+        if rows:
+            dg = csr_matrix((concatenate(vals),
+                             (concatenate(rows), concatenate(cols))),
+                            shape=(self._ncon, self.nparam))
+        else:
+            dg = csr_matrix((self._ncon, self.nparam))
+
+        return df, dg
+
+    def _constraint_positions(self, names):
+        """ Returns the positions in `_con_slices` of the constraints called
+        `names`."""
+
+        known = self.get_eq_constraints().keys() + \
+                self.get_ineq_constraints().keys()
+
+        positions = []
+        for name in names:
+            if name not in known:
+                msg = "Linear constraint '%s' is not a constraint of this " \
+                      "driver." % name
+                self.raise_exception(msg, ValueError)
+            positions.append(known.index(name))
+        return positions
+
+    def _set_linear(self, positions, dg=None):
+        """ Stores the constant Jacobian rows of the constraints at
+        `positions` in `_con_slices`. They are taken from the constraint
+        gradient `dg`, or calculated at the model's current point if it isn't
+        given."""
+
+        if dg is None:
+            cons = [self.cons[k] for k in positions]
+            nrows = sum(self._con_slices[k][2] - self._con_slices[k][1]
+                        for k in positions)
+            J = self._calc_gradient(self.inputs, cons, self.nparam, nrows)
+            row = 0
+            for k in positions:
+                size = self._con_slices[k][2] - self._con_slices[k][1]
+                self._linear[k] = array(J[row:row + size, :])
+                row += size
+        else:
+            for k in positions:
+                _, start, end = self._con_slices[k]
+                self._linear[k] = array(dg[start:end, :])
+
+        self._build_linear_rows()
+
+    def _build_linear_rows(self):
+        """ Gathers the stored rows of the linear constraints into one
+        sparse matrix that is added to the constraint gradient."""
+
+        if not self._linear:
+            self._linear_rows = None
+            return
+
+        rows = []
+        cols = []
+        vals = []
+        for k, block in self._linear.iteritems():
+            i, j = block.nonzero()
+            rows.append(i + self._con_slices[k][1])
+            cols.append(j)
+            vals.append(block[i, j])
+
+        self._linear_rows = csr_matrix((concatenate(vals),
+                                        (concatenate(rows),
+                                         concatenate(cols))),
+                                       shape=(self._ncon, self.nparam))
+
+    def _probe_linear(self, x, dg):
+        """ Keeps the first full constraint gradient, and at the next point
+        marks the constraints whose rows haven't changed as linear. A row
+        only counts if every parameter it depends on has moved."""
+
+        if issparse(dg):
+            dg = dg.toarray()
+
+        if self._linear_probe is None:
+            self._linear_probe = (x.copy(), array(dg))
+            return
+
+        x0, dg0 = self._linear_probe
+        changed = x != x0
+        if not changed.any():
+            return
+
+        positions = []
+        for k, (con, start, end) in enumerate(self._con_slices):
+            if k in self._linear:
+                continue
+            before = dg0[start:end, :]
+            after = dg[start:end, :]
+            depends = (before != 0.0).any(axis=0) | (after != 0.0).any(axis=0)
+            if not changed[depends].all():
+                continue
+            scale = max(1.0, abs(before).max())
+            if abs(after - before).max() <= 1e-10 * scale:
+                positions.append(k)
+
+        self._linear_probe = False
+        if positions:
+            self._set_linear(positions, dg)
+            self._linear_detected.update(positions)
+
+    def _linear_due(self):
+        """ Returns True if this gradient should include the rows of the
+        constraints detected as linear, to check that they haven't changed.
+        Two gradients that agree don't prove a constraint is linear, so they
+        are checked every `linear_recheck` gradients."""
+
+        if not self._linear_detected or self.linear_recheck == 0:
+            return False
+
+        self._linear_calls += 1
+        return self._linear_calls >= self.linear_recheck
+
+    def _recheck_linear(self, dg):
+        """ Stops treating the detected linear constraints whose rows in
+        the full constraint gradient `dg` differ from the stored ones as
+        linear."""
+
+        if issparse(dg):
+            dg = dg.toarray()
+
+        self._linear_calls = 0
+        changed = []
+        for k in self._linear_detected:
+            _, start, end = self._con_slices[k]
+            before = self._linear[k]
+            scale = max(1.0, abs(before).max())
+            if abs(dg[start:end, :] - before).max() > 1e-10 * scale:
+                changed.append(k)
+
+        if changed:
+            for k in changed:
+                del self._linear[k]
+                self._linear_detected.discard(k)
+            self._build_linear_rows()
+
+    def _pattern_due(self, x):
+        """ Returns True if the gradient at `x` should be a full one whose
+        nonzeros go into the detected sparsity. A derivative can be zero at
+        one point and not at others, so the pattern is combined from the
+        first `sparsity_samples` gradients at distinct points, and checked
+        again every `sparsity_recheck` gradients after that."""
+
+        if self._pattern_points < self.sparsity_samples:
+            return self._pattern_x is None or (x != self._pattern_x).any()
+
+        self._pattern_calls += 1
+        return 0 < self.sparsity_recheck <= self._pattern_calls
+
+    def _update_pattern(self, x, dg):
+        """ Adds the nonzeros of the full constraint gradient `dg` at `x` to
+        the detected pattern, and regroups the constraints once enough
+        points have been seen or when the pattern has grown."""
+
+        found = self._nonzero_pattern(dg)
+        if self._pattern is None:
+            grown = True
+            self._pattern = found
+        else:
+            grown = (found & ~self._pattern).any()
+            self._pattern |= found
+
+        self._pattern_x = x.copy()
+        self._pattern_calls = 0
+        if self._pattern_points < self.sparsity_samples:
+            self._pattern_points += 1
+
+        if self._pattern_points >= self.sparsity_samples and \
+           (grown or self._sparsity is None):
+            self._sparsity = self._build_sparsity(self._detect_pattern())
+
+    def _nonzero_pattern(self, dg):
+        """ Returns a boolean array with a row per constraint and a column
+        per parameter, True where the constraint gradient `dg` has a
+        nonzero."""
+
+        if issparse(dg):
+            dg = dg.toarray()
+
+        found = zeros((len(self._con_slices), len(self._layout)), dtype=bool)
+        for k, (con, start, end) in enumerate(self._con_slices):
+            block = dg[start:end, :]
+            for i, (_, _, offset, size, _) in enumerate(self._layout):
+                found[k, i] = block[:, offset:offset + size].any()
+        return found
+
+    def _detect_pattern(self):
+        """ Returns the names of the parameters that each constraint
+        depends on, from the detected pattern."""
+
+        names = self.get_eq_constraints().keys() + \
+                self.get_ineq_constraints().keys()
+        params = [entry[0] for entry in self._layout]
+
+        pattern = {}
+        for k, name in enumerate(names):
+            pattern[name] = [pname for i, pname in enumerate(params)
+                             if self._pattern[k, i]]
+        return pattern
+
+    def _build_sparsity(self, pattern):
+        """ Groups the constraints by the parameters they depend on.
+
+        pattern: dict
+            Maps constraint names to the names of the parameters they depend
+            on. Constraints that aren't in it depend on all parameters.
+
+        Returns a list of `(inputs, columns, members)` tuples for the
+        calc_gradient call of each group: the parameter targets, the
+        Jacobian columns they fill, and the positions of the group's
+        constraints in `_con_slices`.
+        """
+
+        params = [entry[0] for entry in self._layout]
+        for name, pnames in pattern.iteritems():
+            for pname in pnames:
+                if pname not in params:
+                    msg = "Parameter '%s' in the sparsity of constraint " \
+                          "'%s' is not a parameter of this driver." % \
+                          (pname, name)
+                    self.raise_exception(msg, ValueError)
+
+        names = self.get_eq_constraints().keys() + \
+                self.get_ineq_constraints().keys()
+
+        groups = {}
+        order = []
+        for k, name in enumerate(names):
+            key = tuple(sorted(pattern.get(name, params),
+                               key=params.index))
+            if key not in groups:
+                groups[key] = []
+                order.append(key)
+            groups[key].append(k)
+
+        sparsity = []
+        for key in order:
+            if not key:
+                # Constant constraints have an all-zero gradient.
+                continue
+            inputs = []
+            columns = []
+            for pname in key:
+                i = params.index(pname)
+                _, _, offset, size, _ = self._layout[i]
+                inputs.append(self.inputs[i])
+                columns.extend(range(offset, offset + size))
+
+            sparsity.append((inputs, array(columns, dtype=int),
+                             groups[key]))
+
+        return sparsity
+
+    def fdfunc(self, x, f, g, *args, **kwargs):
+        """ Function that finite differences the objective function and
+        constraints. It is passed to pyOpt instead of `gradfunc` when
+        `pyopt_diff` is True and `fd_engine` is 'driver'. All perturbed points
+        are handed to `evaluate_population` together, so they run on the
+        worker pool when `parallel_workers` is greater than 1.
+
+        The step size, step type, and form ('forward', 'backward',
+        'central', or 'complex_step') come from `gradient_options`.
+        Complex step requires a model that accepts complex inputs.
+
+        x: array
+            Design variables
+
+        f: array
+            Objective function evaluated at design variables
+            Note: used as the base point of forward and backward
+            differences, so the model isn't run at `x` again
+
+        g: array
+            Constraints evaluated at design variables
+            Note: used together with `f`
+
+        Returns the same `(d_obj, d_con, fail)` as `gradfunc`.
+        """
+
+        x = array(x[0:self.nparam], dtype=float)
+
+        start = time.time()
+        df, dg, fail = self._fdfunc(x, f, g)
+        elapsed = time.time() - start
+        self._stats.record(self._phase_prefix + 'gradfunc', elapsed)
+        if self._history is not None:
+            self._history.record_grad(x, df, dg, fail, elapsed)
+
+        return df, dg, fail
+
+    def _fdfunc(self, x, f=None, g=None):
+        """ Returns the finite difference objective and constraint
+        gradients and failure flag at `x`. If the objectives `f` and
+        constraints `g` at `x` are given, they are the base point of a
+        forward or backward difference."""
+
+        if self._replay is not None and self._replay.active:
+            replayed = self._replay.next_grad(x)
+            if replayed is not None:
+                return replayed
+
         fail = 1
         df = []
         dg = []
 
+        if len(self._blacklist) > 0 and self._blacklist.get(x) is not None:
+            return df, dg, fail
+
         try:
-            J = self.workflow.calc_gradient(self.inputs, self.objs + self.cons)
+            cached = self._jac_cache.get(x)
+            if cached is not None:
+                df, dg = cached
+                return df.copy(), dg.copy(), 0
+
+            options = self.gradient_options
+            form = options.fd_form
+            step = options.fd_step
+            if options.fd_step_type == 'relative':
+                steps = where(x != 0.0, step*abs(x), step)
+            else:
+                steps = step*ones(len(x))
+
+            points = []
+            if form == 'complex_step':
+                for i in range(len(x)):
+                    xp = x.astype(complex)
+                    xp[i] += 1j*steps[i]
+                    points.append(xp)
+            elif form == 'central':
+                for i in range(len(x)):
+                    xp = x.copy()
+                    xp[i] += steps[i]
+                    xm = x.copy()
+                    xm[i] -= steps[i]
+                    points.extend([xp, xm])
+            else:
+                if form == 'backward':
+                    steps = -steps
+                base = self._base_values(f, g)
+                if base is None:
+                    points.append(x)
+                for i in range(len(x)):
+                    xp = x.copy()
+                    xp[i] += steps[i]
+                    points.append(xp)
+
+            results = self.evaluate_population(points)
+            if any(result[2] for result in results):
+                print "Finite difference failed at one or more points."
+                return df, dg, fail
+
+            # One row per point, one column per objective or constraint.
+            values = vstack([concatenate((result[0], result[1]))
+                             for result in results])
+
+            if form == 'complex_step':
+                J = values.imag.T / steps
+            elif form == 'central':
+                J = (values[0::2] - values[1::2]).T / (2.0*steps)
+            else:
+                if base is not None:
+                    values = vstack((base, values))
+                J = (values[1:] - values[0]).T / steps
 
             nobj = len(self.objs)
             df = J[0:nobj, :]
@@ -307,6 +1686,14 @@ class pyOptDriver(Driver):
 
             fail = 0
 
+            self._jac_cache.put(x, (df.copy(), dg.copy()))
+
+        except EvaluationTimeout as msg:
+
+            self._timed_out(x, msg)
+            if self.timeout_policy == 'blacklist':
+                self._blacklist.put(x, True)
+
         except Exception as msg:
 
             # Exceptions seem to be swallowed by the C code, so this
@@ -319,5 +1706,202 @@ class pyOptDriver(Driver):
 
         return df, dg, fail
 
+    def _base_values(self, f, g):
+        """ Returns the objectives `f` and constraints `g` that pyOpt
+        passed in as one row, or None if they aren't usable."""
+
+        if f is None or g is None:
+            return None
+
+        f = array(f, dtype=float).ravel()
+        g = array(g, dtype=float).ravel()
+        if len(f) != len(self._fbuf) or len(g) < self._ncon:
+            return None
+        return concatenate((f, g[0:self._ncon]))
+
+    def _run_model(self, x):
+        """ Sets the design variables to `x` and executes the model."""
+
+        with self._stats.timer('set_parameters'):
+            if self.incremental and self._model_x is not None and \
+               len(self._model_x) == len(x):
+                self._set_parameters(x, self._model_x)
+            else:
+                self._set_parameters(x)
+
+        # Execute the model
+        self._model_x = None
+        with self._stats.timer('run_iteration'):
+            self.run_iteration()
+        self._model_x = x.copy()
+
+    def _set_parameters(self, x, last=None):
+        """ Sets the design variables to `x`. Integer parameters come back
+        from pyOpt as floats, so they are rounded and set as python integers
+        one parameter at a time, and the rest of `x` is set as it is.
+
+        If `last`, the point the model was last run at, is given, only the
+        parameters whose values in `x` differ from it are set. Setting a
+        parameter invalidates everything downstream of its targets, so
+        leaving the others alone means that the workflow only re-runs the
+        components that depend on what changed."""
+
+        if self._layout is None:
+            # A pickled copy of the driver has no layout until it is set up
+            # again.
+            self.set_parameters(self._parameter_values(x))
+            return
+
+        if last is None and len(self._int_idx) == 0:
+            self.set_parameters(x)
+            return
+
+        changed = None if last is None else x != last
+        params = self.get_parameters()
+        for name, vartype, offset, size, choices in self._layout:
+            end = offset + size
+            if changed is not None and not changed[offset:end].any():
+                continue
+            if vartype == 'i':
+                values = rint(x[offset:end].real).astype(int64).tolist()
+            else:
+                values = x[offset:end]
+            if size == 1:
+                params[name].set(values[0])
+            else:
+                params[name].set(values)
+
+    def _parameter_values(self, x):
+        """ Returns the design vector `x` in the form set_parameters needs.
+        Integer parameters come back from pyOpt as floats, so they are
+        rounded and turned into python integers. Only used when the
+        problem layout isn't available."""
+
+        int_idx = self._int_idx
+        if len(int_idx) == 0:
+            return x
+
+        values = x.astype(object)
+        values[int_idx] = rint(x[int_idx]).astype(int64).tolist()
+        return values
+
+    def _solution_vector(self, solution):
+        """ Returns the design variables of a pyOpt Solution as an array,
+        with the integer parameters rounded."""
+
+        variables = solution._variables
+        x = fromiter((variables[i].value for i in xrange(self.nparam)),
+                     dtype=float, count=self.nparam)
+
+        int_idx = self._int_idx
+        if len(int_idx) > 0:
+            x[int_idx] = rint(x[int_idx])
+        return x
+
+    def _model_is_at(self, x):
+        """ Returns True if the last successful model evaluation was at `x`
+        (to within `cache_tol`)."""
+
+        if self._model_x is None:
+            return False
+
+        return self._same_point(x, self._model_x)
+
+    def _same_point(self, x, y):
+        """ Returns True if the design vectors `x` and `y` differ by no more
+        than `cache_tol` in any entry. Complex points only match complex
+        points."""
+
+        x = asarray(x)
+        y = asarray(y)
+        if x.shape != y.shape or iscomplexobj(x) != iscomplexobj(y):
+            return False
+
+        return abs(x - y).max() <= self.cache_tol if x.size else True
+
+    def _final_run(self, x_opt, best):
+        """ Leaves the model at the solution `x_opt`. The re-run is skipped
+        if the model is already sitting there, or if `best`, the
+        `(x, f, snapshot)` of the best feasible point, is a snapshot of it
+        there. A re-run that goes over `eval_timeout` is abandoned and
+        counted in `timeouts`."""
+
+        if self._model_is_at(x_opt):
+            return
+
+        if best is not None and self._same_point(best[0], x_opt) and \
+           self._restore_snapshot(best[2]):
+            self._model_x = best[0]
+            return
+
+        self._model_x = None
+        self._set_parameters(x_opt)
+        try:
+            with Watchdog(self.eval_timeout):
+                self.run_iteration()
+        except EvaluationTimeout as msg:
+            self._timed_out(x_opt, msg)
+            self.timeouts = self._timeouts
+            print "The model was not left at the solution."
+
+    def _update_best(self, x, f, g):
+        """ Snapshots the model if `x` is the best feasible point so far.
+        Only single objective problems have a best point. Each snapshot
+        deep-copies every input and output of every component in the
+        workflow, so with large array variables an improving evaluation
+        can cost noticeably more than the model run itself."""
+
+        if len(f) != 1:
+            return
+
+        if not self._is_feasible(g):
+            return
+
+        if self._best is not None and f[0] >= self._best[1]:
+            return
+
+        self._best = (x.copy(), f[0], self._take_snapshot(self.workflow))
+
+    def _is_feasible(self, g):
+        """ Returns True if the constraint values `g` are all satisfied to
+        within `feasibility_tol`."""
+
+        g = array(g)
+        neq = self._neq
+        tol = self.feasibility_tol
+        return not ((abs(g[:neq]) > tol).any() or (g[neq:] > tol).any())
+
+    def _take_snapshot(self, workflow):
+        """ Returns a copy of every input and output of the components in
+        `workflow`, including those in the workflows of sub-drivers."""
+
+        snapshot = []
+        for comp in workflow.__iter__():
+            values = {}
+            for name in comp.list_inputs() + comp.list_outputs():
+                values[name] = deepcopy(comp.get(name))
+            snapshot.append((comp, values))
+
+            if isinstance(comp, Driver):
+                snapshot.extend(self._take_snapshot(comp.workflow))
+
+        return snapshot
+
+    def _restore_snapshot(self, snapshot):
+        """ Puts the values from `snapshot` back into the model. Returns
+        False if they couldn't all be set, in which case the model has to be
+        re-run."""
+
+        try:
+            for comp, values in snapshot:
+                for name, value in values.iteritems():
+                    comp.set(name, value, force=True)
+        except Exception as msg:
+            print "Could not restore snapshot, re-running instead: %s" % \
+                  str(msg)
+            return False
+
+        return True
+
     def requires_derivs(self):
         return True
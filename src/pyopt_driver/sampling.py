@@ -0,0 +1,140 @@
+"""
+Space-filling samples of starting points for the pyOpt driver's multi-start
+mode.
+
+Both samplers return points in the box between `low` and `high`, one row
+per point.
+"""
+
+# pylint: disable=E0611,F0401
+from numpy import arange, asarray, empty, zeros
+from numpy.random import RandomState
+
+# Primitive polynomials and initial direction numbers for dimensions 2 and
+# up, from S. Joe and F. Y. Kuo, "Constructing Sobol sequences with better
+# two-dimensional projections", SIAM J. Sci. Comput. 30, 2635-2654 (2008).
+# Each entry is (degree, coefficients, initial direction numbers).
+_SOBOL_POLYS = [
+    (1, 0, (1,)),
+    (2, 1, (1, 3)),
+    (3, 1, (1, 3, 1)),
+    (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)),
+    (5, 4, (1, 1, 5, 5, 5)),
+    (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)),
+    (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+    (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+]
+
+_SOBOL_BITS = 30
+
+MAX_SOBOL_DIMENSION = len(_SOBOL_POLYS) + 1
+
+
+def _scale(unit, low, high):
+    """ Maps points in the unit cube onto the box between `low` and `high`.
+    """
+
+    low = asarray(low, dtype=float)
+    high = asarray(high, dtype=float)
+    return low + unit * (high - low)
+
+
+def latin_hypercube(n, low, high, seed=None):
+    """ Returns `n` points from a Latin hypercube sample of the box between
+    `low` and `high`. Each design variable's range is split into `n` equal
+    intervals, and each interval holds exactly one point.
+
+    n: int
+        Number of points.
+
+    low, high: arrays
+        Lower and upper bounds of each design variable.
+
+    seed: int
+        Seed for the random number generator.
+    """
+
+    ndim = len(low)
+    rng = RandomState(seed)
+
+    unit = empty((n, ndim))
+    for j in range(ndim):
+        unit[:, j] = (rng.permutation(n) + rng.uniform(size=n)) / n
+
+    return _scale(unit, low, high)
+
+
+def _direction_numbers(ndim):
+    """ Returns the Sobol direction numbers, one row per dimension."""
+
+    bits = _SOBOL_BITS
+    v = zeros((ndim, bits), dtype=int)
+
+    # The first dimension is the van der Corput sequence.
+    v[0, :] = 1 << (bits - 1 - arange(bits))
+
+    for d in range(1, ndim):
+        degree, coeffs, m = _SOBOL_POLYS[d - 1]
+        for i in range(min(degree, bits)):
+            v[d, i] = m[i] << (bits - 1 - i)
+        for i in range(degree, bits):
+            value = v[d, i - degree] ^ (v[d, i - degree] >> degree)
+            for k in range(1, degree):
+                if (coeffs >> (degree - 1 - k)) & 1:
+                    value ^= v[d, i - k]
+            v[d, i] = value
+
+    return v
+
+
+def sobol(n, low, high, skip=1):
+    """ Returns `n` points of the Sobol sequence, scaled to the box between
+    `low` and `high`.
+
+    n: int
+        Number of points.
+
+    low, high: arrays
+        Lower and upper bounds of each design variable.
+
+    skip: int
+        Number of points to skip at the start of the sequence. The first
+        point is the lower corner of the box, which is rarely a useful
+        start, so it is skipped by default.
+    """
+
+    ndim = len(low)
+    if ndim > MAX_SOBOL_DIMENSION:
+        msg = "Sobol sampling supports at most %d design variables, not " \
+              "%d. Use Latin hypercube sampling instead." % \
+              (MAX_SOBOL_DIMENSION, ndim)
+        raise ValueError(msg)
+
+    v = _direction_numbers(ndim)
+
+    # Gray code order: each point differs from the last in the direction
+    # number of the lowest zero bit of its index.
+    unit = empty((n, ndim))
+    state = zeros(ndim, dtype=int)
+    scale = float(1 << _SOBOL_BITS)
+    for i in range(skip + n):
+        if i >= skip:
+            unit[i - skip, :] = state / scale
+        c = 0
+        while (i >> c) & 1:
+            c += 1
+        state = state ^ v[:, c]
+
+    return _scale(unit, low, high)
@@ -0,0 +1,191 @@
+"""
+Timing statistics for the pyOpt driver.
+
+The driver times each phase of its hot path (setting parameters, running
+the model, evaluating objectives and constraints, calculating gradients) as
+well as the objfunc and gradfunc calls as a whole. The time pyOpt spends on
+its own is what's left of the optimizer's wall time.
+"""
+
+from bisect import bisect_left
+import cProfile
+import heapq
+import pstats
+from StringIO import StringIO
+import time
+
+_INF = float('inf')
+
+
+class _NullTimer(object):
+    """ Context manager that does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    """ Context manager that records its wall time against a phase."""
+
+    __slots__ = ('stats', 'phase', 'start')
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record(self.phase, time.time() - self.start)
+        return False
+
+
+class PhaseStats(object):
+    """ Call count, total and extreme times, and a latency histogram for
+    one phase."""
+
+    # Upper edges of the histogram buckets, in seconds.
+    edges = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0, 100.0, 1000.0, _INF)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = _INF
+        self.max = 0.0
+        self.histogram = [0]*len(self.edges)
+
+    @property
+    def mean(self):
+        """ Average time per call."""
+        return self.total / self.count if self.count else 0.0
+
+    def add(self, elapsed):
+        """ Adds one call that took `elapsed` seconds."""
+
+        self.count += 1
+        self.total += elapsed
+        if elapsed < self.min:
+            self.min = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        self.histogram[bisect_left(self.edges, elapsed)] += 1
+
+
+class NullStats(object):
+    """ Stand-in used when statistics are turned off, so that the hot path
+    doesn't need to check."""
+
+    def timer(self, phase):
+        """ Returns a context manager that does nothing."""
+        return _NULL_TIMER
+
+    def record(self, phase, elapsed):
+        """ Does nothing."""
+        pass
+
+    def profile(self, x, func, *args):
+        """ Calls `func`."""
+        return func(*args)
+
+
+class DriverStats(object):
+    """ Timing statistics collected during one run of the driver.
+
+    profile_slowest: int
+        If nonzero, every model evaluation is run under cProfile and the
+        profiles of this many of the slowest are kept in `slowest`.
+
+    callback: callable
+        Called as `callback(phase, elapsed, stats)` every time a phase is
+        timed.
+    """
+
+    def __init__(self, profile_slowest=0, callback=None):
+
+        self.phases = {}
+        self.profile_slowest = profile_slowest
+        self.callback = callback
+        self._slowest = []
+        self._profiled = 0
+
+    @property
+    def slowest(self):
+        """ List of `(elapsed, x, pstats.Stats)` for the slowest profiled
+        evaluations, slowest first."""
+
+        return [(elapsed, x, stats) for elapsed, _, x, stats in
+                sorted(self._slowest, reverse=True)]
+
+    def timer(self, phase):
+        """ Returns a context manager that times its body as `phase`."""
+        return _Timer(self, phase)
+
+    def record(self, phase, elapsed):
+        """ Adds a call to `phase` that took `elapsed` seconds."""
+
+        try:
+            stats = self.phases[phase]
+        except KeyError:
+            stats = self.phases[phase] = PhaseStats()
+        stats.add(elapsed)
+
+        if self.callback is not None:
+            self.callback(phase, elapsed, self)
+
+    def profile(self, x, func, *args):
+        """ Calls `func` for the design point `x`, under cProfile if we are
+        keeping the slowest evaluations."""
+
+        if self.profile_slowest <= 0:
+            return func(*args)
+
+        prof = cProfile.Profile()
+        start = time.time()
+        result = prof.runcall(func, *args)
+        elapsed = time.time() - start
+
+        # The counter breaks ties so that the profiles are never compared.
+        self._profiled += 1
+        entry = (elapsed, self._profiled, x.copy(), pstats.Stats(prof))
+        if len(self._slowest) < self.profile_slowest:
+            heapq.heappush(self._slowest, entry)
+        elif elapsed > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+        return result
+
+    def total(self, phase):
+        """ Returns the total time spent in `phase`."""
+
+        stats = self.phases.get(phase)
+        return stats.total if stats is not None else 0.0
+
+    def pyopt_overhead(self):
+        """ Returns the time spent in the optimizer outside of objfunc and
+        gradfunc."""
+
+        return self.total('optimizer') - self.total('objfunc') - \
+               self.total('gradfunc')
+
+    def report(self):
+        """ Returns a table of the collected statistics as a string."""
+
+        out = StringIO()
+        out.write('%-18s %8s %12s %12s %12s %12s\n' %
+                  ('phase', 'count', 'total (s)', 'mean (s)', 'min (s)',
+                   'max (s)'))
+        for phase in sorted(self.phases):
+            stats = self.phases[phase]
+            out.write('%-18s %8d %12.4g %12.4g %12.4g %12.4g\n' %
+                      (phase, stats.count, stats.total, stats.mean,
+                       stats.min, stats.max))
+        out.write('pyOpt overhead: %.4g s\n' % self.pyopt_overhead())
+        return out.getvalue()
@@ -0,0 +1,200 @@
+"""
+Surrogate screening of design points for the pyOpt driver.
+
+Population optimizers (ALPSO, ALHSO, NSGA2) spend most of their evaluations
+on candidates that are clearly worse than the best points already found. The
+screen keeps a radial basis function model of the objectives and constraints,
+trained on the points the model has actually been run at. Candidates that the
+surrogate predicts to be clearly worse, and that are close enough to the
+training points for that prediction to be trusted, are answered with the
+prediction instead of a model run.
+"""
+
+# pylint: disable=E0611,F0401
+from numpy import asarray, concatenate, hstack, ones, sqrt, vstack, where, \
+                  zeros
+from numpy.linalg import lstsq
+
+
+class RBFSurrogate(object):
+    """ Cubic radial basis function interpolant with a linear tail, fitted to
+    several outputs at once. Inputs are expected to be scaled to the unit
+    cube."""
+
+    def __init__(self):
+
+        self.centers = None
+        self._weights = None
+        self._tail = None
+
+    def fit(self, X, Y):
+        """ Fits the model to the rows of inputs `X` and outputs `Y`."""
+
+        X = asarray(X, dtype=float)
+        Y = asarray(Y, dtype=float)
+        n, ndim = X.shape
+
+        phi = self._basis(X, X)
+        P = hstack((ones((n, 1)), X))
+        A = vstack((hstack((phi, P)),
+                    hstack((P.T, zeros((ndim + 1, ndim + 1))))))
+        b = vstack((Y, zeros((ndim + 1, Y.shape[1]))))
+
+        # Duplicate or nearly duplicate points make the system singular, so
+        # it is solved in the least squares sense.
+        coeffs = lstsq(A, b, rcond=-1)[0]
+
+        self.centers = X
+        self._weights = coeffs[:n]
+        self._tail = coeffs[n:]
+
+    def predict(self, x):
+        """ Returns the predicted outputs at the point `x`, and the distance
+        from `x` to the nearest training point."""
+
+        x = asarray(x, dtype=float).reshape(1, -1)
+        dist = sqrt(((self.centers - x)**2).sum(axis=1))
+
+        y = (dist**3).dot(self._weights) + \
+            hstack((ones(1), x[0])).dot(self._tail)
+        return y, dist.min()
+
+    @staticmethod
+    def _basis(X, C):
+        """ Returns the cubic basis of each row of `X` about each row of
+        `C`."""
+
+        diff = X[:, None, :] - C[None, :, :]
+        return sqrt((diff**2).sum(axis=2))**3
+
+
+class SurrogateScreen(object):
+    """ Decides which candidates need a real model evaluation.
+
+    low, high: arrays
+        Bounds of the design variables, used to scale them.
+
+    neq: int
+        Number of equality constraints, which come first in `g`.
+
+    min_points: int
+        Number of real evaluations needed before the surrogate is used.
+
+    refresh: int
+        The surrogate is refitted after this many new real evaluations.
+
+    radius: float
+        Candidates further than this from every training point, in the
+        design space scaled to the unit cube, are always evaluated.
+
+    margin: float
+        A candidate is only answered by the surrogate if a real feasible
+        point beats its predicted objectives by more than this fraction of
+        their observed range, or if its predicted constraint violation is
+        more than this fraction of the observed range of constraint values.
+
+    tol: float
+        Constraint violation allowed for a real point to count as feasible.
+
+    size: int
+        Largest number of training points. The oldest points are dropped
+        first.
+    """
+
+    def __init__(self, low, high, neq, min_points=20, refresh=10, radius=0.1,
+                 margin=0.1, tol=1e-6, size=500):
+
+        self.low = asarray(low, dtype=float)
+        span = asarray(high, dtype=float) - self.low
+        self.span = where(span > 0.0, span, 1.0)
+        self.neq = neq
+        self.min_points = min_points
+        self.refresh = refresh
+        self.radius = radius
+        self.margin = margin
+        self.tol = tol
+        self.size = size
+
+        self.true_evals = 0
+        self.surrogate_evals = 0
+
+        self._X = []
+        self._F = []
+        self._G = []
+        self._model = None
+        self._added = 0
+
+    def _violation(self, G):
+        """ Returns the largest constraint violation in each row of `G`."""
+
+        G = asarray(G, dtype=float)
+        if G.shape[-1] == 0:
+            return zeros(G.shape[:-1])
+        neq = self.neq
+        return concatenate((abs(G[..., :neq]), G[..., neq:]),
+                           axis=-1).max(axis=-1).clip(0.0)
+
+    def add(self, x, f, g):
+        """ Adds a real evaluation to the training set."""
+
+        self.true_evals += 1
+        self._X.append((asarray(x, dtype=float) - self.low) / self.span)
+        self._F.append(asarray(f, dtype=float))
+        self._G.append(asarray(g, dtype=float))
+        if len(self._X) > self.size:
+            del self._X[0], self._F[0], self._G[0]
+
+        self._added += 1
+        if self._model is not None and self._added >= self.refresh:
+            self._model = None
+
+    def screen(self, x):
+        """ Returns the predicted `(f, g)` at `x` if the candidate can be
+        skipped, or None if it should be evaluated."""
+
+        npoints = len(self._X)
+        if npoints < self.min_points:
+            return None
+
+        F = asarray(self._F)
+        G = asarray(self._G).reshape(npoints, -1)
+        nobj = F.shape[1]
+
+        if self._model is None:
+            self._model = RBFSurrogate()
+            self._model.fit(asarray(self._X), hstack((F, G)))
+            self._added = 0
+
+        y, dist = self._model.predict((asarray(x, dtype=float) - self.low) /
+                                      self.span)
+        if dist > self.radius:
+            return None
+
+        f = y[:nobj]
+        g = y[nobj:]
+
+        violation = self._violation(G)
+        feasible = violation <= self.tol
+        if not feasible.any():
+            return None
+
+        frange = F.max(axis=0) - F.min(axis=0)
+        gap = self.margin * frange
+
+        # Clearly infeasible.
+        if len(g) > 0 and \
+           self._violation(g) > self.margin * (G.max() - G.min()):
+            return self._skip(f, g)
+
+        # Clearly dominated by a real feasible point.
+        better = (F[feasible] < f - gap).all(axis=1)
+        if better.any():
+            return self._skip(f, g)
+
+        return None
+
+    def _skip(self, f, g):
+        """ Counts a candidate answered by the surrogate."""
+
+        self.surrogate_evals += 1
+        return f, g
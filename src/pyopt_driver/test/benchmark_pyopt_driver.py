@@ -0,0 +1,310 @@
+"""
+Benchmarks of the pyOpt driver's own overhead.
+
+The model is a single component that costs next to nothing to run, so the
+times measured are the driver's: setting up the pyOpt problem, the work done
+in each objfunc and gradfunc call around the model, and pulling the solution
+back out. Problems scale from 10 to 100,000 design variables.
+
+Two kinds of benchmark are run for each problem size:
+
+* 'driver': objfunc and gradfunc are called directly at a series of points,
+  so the per-call overhead is measured the same way for every size.
+* each optimizer found by the driver: a short run with the iteration limit
+  below, which also times setup and solution extraction. Only problems up
+  to --max-opt-size design variables are run through the optimizers.
+
+Results are written as JSON, and two result files can be compared::
+
+    python benchmark_pyopt_driver.py --out new.json
+    python benchmark_pyopt_driver.py --compare old.json new.json
+"""
+
+from argparse import ArgumentParser
+import json
+import platform
+import sys
+import time
+
+# pylint: disable=E0611,F0401
+from numpy import ones, zeros
+
+from openmdao.main.api import Assembly, Component, set_as_top
+from openmdao.main.datatypes.api import Array, Float, Int
+
+from pyopt_driver.cache import EvaluationCache
+from pyopt_driver.pyopt_driver import pyOptDriver, _check_imports
+from pyopt_driver.stats import DriverStats
+
+# Options that keep each optimizer's run short.
+ITERATION_LIMITS = {
+    'ALPSO': {'SwarmSize': 10, 'maxOuterIter': 2, 'maxInnerIter': 2,
+              'minInnerIter': 1},
+    'COBYLA': {'MAXFUN': 50},
+    'CONMIN': {'ITMAX': 5},
+    'KSOPT': {'ITMAX': 5},
+    'NLPQL': {'MAXIT': 5},
+    'NSGA2': {'PopSize': 12, 'maxGen': 2, 'PrintOut': 0},
+    'PSQP': {'MIT': 5},
+    'SDPEN': {'nf_max': 50},
+    'SLSQP': {'MAXIT': 5},
+    'SNOPT': {'Major iterations limit': 5},
+}
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+
+# Phases reported from the driver's statistics.
+PHASES = ('setup', 'objfunc', 'gradfunc', 'run_iteration', 'calc_gradient',
+          'extract_solution', 'optimizer')
+
+
+class SyntheticModel(Component):
+    """ Cheap model with `nparam` continuous inputs, `nint` integer inputs,
+    a quadratic objective and `ncon` linear constraints."""
+
+    f = Float(0.0, iotype='out', desc='Objective')
+
+    def __init__(self, nparam, ncon, nint):
+
+        super(SyntheticModel, self).__init__()
+
+        self.nparam = nparam
+        self.ncon = ncon
+        self.nint = nint
+
+        self.add('x', Array(ones(nparam), iotype='in',
+                            desc='Continuous design variables'))
+        self.add('c', Array(zeros(ncon), iotype='out', desc='Constraints'))
+        for k in range(nint):
+            self.add('i%d' % k, Int(1, iotype='in', low=-10, high=10,
+                                    desc='Integer design variable'))
+
+    def execute(self):
+
+        x = self.x
+        total = sum(self.get('i%d' % k) for k in range(self.nint))
+        self.f = (x**2).sum() + total**2
+
+        # Constraint k is x[k] >= 0.5, wrapping around if there are more
+        # constraints than variables.
+        self.c = 0.5 - x[[k % self.nparam for k in range(self.ncon)]]
+
+    def list_deriv_vars(self):
+        return ('x',), ('f', 'c')
+
+    def provideJ(self):
+
+        J = zeros((1 + self.ncon, self.nparam))
+        J[0, :] = 2.0*self.x
+        for k in range(self.ncon):
+            J[1 + k, k % self.nparam] = -1.0
+        return J
+
+
+class SyntheticOptimization(Assembly):
+    """ Assembly of a SyntheticModel and a pyOptDriver."""
+
+    def __init__(self, nparam, ncon, nint):
+
+        super(SyntheticOptimization, self).__init__()
+
+        self.add('model', SyntheticModel(nparam, ncon, nint))
+        self.add('driver', pyOptDriver())
+        self.driver.workflow.add('model')
+
+        self.driver.add_objective('model.f')
+        self.driver.add_parameter('model.x', low=-10.0, high=10.0)
+        for k in range(nint):
+            self.driver.add_parameter('model.i%d' % k, low=-10, high=10)
+        if ncon > 0:
+            self.driver.add_constraint('model.c <= 0.0')
+
+        self.driver.print_results = False
+        self.driver.collect_stats = True
+
+
+def _summarize(stats):
+    """ Returns the per-phase numbers of a DriverStats as a dict."""
+
+    phases = {}
+    for phase in PHASES:
+        entry = stats.phases.get(phase)
+        if entry is None:
+            continue
+        phases[phase] = {'count': entry.count, 'total': entry.total,
+                         'mean': entry.mean, 'min': entry.min,
+                         'max': entry.max}
+    return phases
+
+
+def bench_calls(nparam, ncon, nint, ncalls):
+    """ Times `ncalls` objfunc and gradfunc calls at distinct points,
+    outside of any optimizer."""
+
+    top = set_as_top(SyntheticOptimization(nparam, ncon, nint))
+    driver = top.driver
+
+    stats = DriverStats()
+    driver._stats = stats
+    with stats.timer('setup'):
+        driver.run_iteration()
+        driver._setup_problem()
+    driver._cache = EvaluationCache()
+    driver._jac_cache = EvaluationCache()
+
+    x = ones(driver.nparam)
+    for i in range(ncalls):
+        x[0] = 1.0 + i
+        f, g, fail = driver.objfunc(x)
+        if nint == 0:
+            driver.gradfunc(x, f, g)
+
+    result = {'benchmark': 'driver', 'nparam': driver.nparam,
+              'ncon': ncon, 'nint': nint, 'phases': _summarize(stats)}
+    result['overhead'] = _overhead(stats)
+    return result
+
+
+def bench_optimizer(optimizer, nparam, ncon, nint):
+    """ Times a short run of `optimizer`."""
+
+    top = set_as_top(SyntheticOptimization(nparam, ncon, nint))
+    driver = top.driver
+    driver.optimizer = optimizer
+    driver.options = ITERATION_LIMITS[optimizer]
+
+    start = time.time()
+    top.run()
+    elapsed = time.time() - start
+
+    result = {'benchmark': optimizer, 'nparam': driver.nparam,
+              'ncon': ncon, 'nint': nint, 'phases': _summarize(driver.stats),
+              'wall': elapsed}
+    result['overhead'] = _overhead(driver.stats)
+    result['pyopt_overhead'] = driver.stats.pyopt_overhead()
+    return result
+
+
+def _overhead(stats):
+    """ Returns the mean time per objfunc and gradfunc call spent outside
+    the model run and calc_gradient."""
+
+    overhead = {}
+    objfunc = stats.phases.get('objfunc')
+    if objfunc is not None and objfunc.count:
+        overhead['objfunc'] = (objfunc.total - stats.total('run_iteration')) \
+                              / objfunc.count
+    gradfunc = stats.phases.get('gradfunc')
+    if gradfunc is not None and gradfunc.count:
+        overhead['gradfunc'] = (gradfunc.total -
+                                stats.total('calc_gradient')) / gradfunc.count
+    return overhead
+
+
+def run(sizes, ncon, nint, ncalls, max_opt_size, optimizers):
+    """ Runs every benchmark and returns the results as a dict."""
+
+    results = []
+    for nparam in sizes:
+        print "driver: %d variables" % nparam
+        results.append(bench_calls(nparam, ncon, nint, ncalls))
+
+        if nparam > max_opt_size:
+            continue
+        for optimizer in optimizers:
+            if optimizer not in ITERATION_LIMITS:
+                print "%s: skipped, no iteration limit known" % optimizer
+                continue
+            print "%s: %d variables" % (optimizer, nparam)
+            try:
+                results.append(bench_optimizer(optimizer, nparam, ncon, nint))
+            except Exception as err:
+                results.append({'benchmark': optimizer, 'nparam': nparam,
+                                'ncon': ncon, 'nint': nint,
+                                'error': str(err)})
+
+    return {'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'results': results}
+
+
+def compare(old, new):
+    """ Prints the ratio of new to old mean times for each benchmark and
+    phase found in both result files."""
+
+    def index(data):
+        entries = {}
+        for result in data['results']:
+            key = (result['benchmark'], result['nparam'], result['ncon'],
+                   result['nint'])
+            entries[key] = result
+        return entries
+
+    old = index(old)
+    new = index(new)
+
+    print '%-10s %8s %-18s %12s %12s %8s' % ('benchmark', 'nparam', 'phase',
+                                             'old (s)', 'new (s)', 'ratio')
+    for key in sorted(set(old) & set(new)):
+        old_phases = old[key].get('phases', {})
+        new_phases = new[key].get('phases', {})
+        for phase in PHASES:
+            if phase not in old_phases or phase not in new_phases:
+                continue
+            before = old_phases[phase]['mean']
+            after = new_phases[phase]['mean']
+            ratio = after / before if before > 0.0 else float('inf')
+            print '%-10s %8d %-18s %12.4g %12.4g %8.2f' % \
+                  (key[0], key[1], phase, before, after, ratio)
+
+
+def main(argv=None):
+    """ Command line entry point."""
+
+    parser = ArgumentParser(description='Benchmark the overhead of the '
+                                        'pyOpt driver.')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in
+                                                    DEFAULT_SIZES),
+                        help='Comma separated numbers of continuous design '
+                             'variables.')
+    parser.add_argument('--ncon', type=int, default=10,
+                        help='Number of scalar constraints.')
+    parser.add_argument('--nint', type=int, default=0,
+                        help='Number of integer design variables.')
+    parser.add_argument('--ncalls', type=int, default=20,
+                        help='Number of direct objfunc/gradfunc calls.')
+    parser.add_argument('--max-opt-size', type=int, default=1000,
+                        help='Largest problem run through the optimizers.')
+    parser.add_argument('--optimizers', default='',
+                        help='Comma separated optimizers to run. Defaults to '
+                             'all that are installed.')
+    parser.add_argument('--out', default='pyopt_driver_benchmark.json',
+                        help='File the results are written to.')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two result files instead of running.')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as stream:
+            old = json.load(stream)
+        with open(args.compare[1]) as stream:
+            new = json.load(stream)
+        compare(old, new)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.optimizers:
+        optimizers = args.optimizers.split(',')
+    else:
+        optimizers = _check_imports()
+
+    data = run(sizes, args.ncon, args.nint, args.ncalls, args.max_opt_size,
+               optimizers)
+    with open(args.out, 'w') as stream:
+        json.dump(data, stream, indent=1)
+    print "Results written to %s" % args.out
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 # pylint: disable=E0611,F0401
@@ -338,6 +341,426 @@ class pyOptDriverTestCase(unittest.TestCase):
         assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
         assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
 
+    def test_evaluation_cache(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.title = 'Little Test'
+        self.top.driver.options = {}
+        self.top.driver.pyopt_diff = True
+        self.top.driver.cache_size = 100
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+        self.assertTrue(self.top.driver.cache_misses > 0)
+
+        # A second run starts with an empty cache.
+        misses = self.top.driver.cache_misses
+        self.top.paraboloid.x = 0.0
+        self.top.paraboloid.y = 0.0
+        self.top.run()
+        self.assertEqual(self.top.driver.cache_misses, misses)
+
+    def test_optimizer_cache(self):
+
+        try:
+            from pyopt_driver import pyopt_driver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        def make_optimizer(name, files):
+            path = os.path.join(pyopt_driver._PYOPT_PATH, 'py%s' % name)
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for fname in files:
+                open(os.path.join(path, fname), 'w').close()
+            return path
+
+        tmpdir = tempfile.mkdtemp()
+        saved = (pyopt_driver._PYOPT_PATH, pyopt_driver._OPTIMIZER_CACHE,
+                 pyopt_driver._has_optimizer)
+        try:
+            pyopt_driver._PYOPT_PATH = os.path.join(tmpdir, 'pyOpt')
+            pyopt_driver._OPTIMIZER_CACHE = os.path.join(tmpdir, 'cache',
+                                                         'optimizers.json')
+
+            # Pure Python ALPSO, built SLSQP, and CONMIN without its
+            # extension.
+            make_optimizer('ALPSO', ['pyALPSO.py'])
+            make_optimizer('SLSQP', ['pySLSQP.py', 'slsqp.so'])
+            conmin = make_optimizer('CONMIN', ['pyCONMIN.py'])
+
+            self.assertEqual(pyopt_driver._check_imports(), ['ALPSO', 'SLSQP'])
+            self.assertTrue(os.path.isfile(pyopt_driver._OPTIMIZER_CACHE))
+
+            # The second time, the answer comes from the cache.
+            def no_probe(name):
+                raise AssertionError("cache not used for %s" % name)
+            pyopt_driver._has_optimizer = no_probe
+            self.assertEqual(pyopt_driver._check_imports(), ['ALPSO', 'SLSQP'])
+
+            # Building CONMIN changes its directory, so the cache is stale.
+            pyopt_driver._has_optimizer = saved[2]
+            make_optimizer('CONMIN', ['conmin.so'])
+            stamp = os.path.getmtime(conmin) + 10.0
+            os.utime(conmin, (stamp, stamp))
+            self.assertEqual(pyopt_driver._check_imports(),
+                             ['ALPSO', 'CONMIN', 'SLSQP'])
+        finally:
+            pyopt_driver._PYOPT_PATH, pyopt_driver._OPTIMIZER_CACHE, \
+                pyopt_driver._has_optimizer = saved
+            shutil.rmtree(tmpdir)
+
+    def test_evaluation_cache_keys(self):
+
+        from pyopt_driver.cache import EvaluationCache
+
+        cache = EvaluationCache(10, 1e-12)
+
+        # Large values must not collapse onto the same key.
+        cache.put([1e7, 0.0], 'a')
+        self.assertEqual(cache.get([-4e9, 0.0]), None)
+        self.assertEqual(cache.get([1e7, 0.0]), 'a')
+        cache.put([1e300, -1e300], 'b')
+        self.assertEqual(cache.get([1e300, -1e300]), 'b')
+        self.assertEqual(cache.get([-1e300, 1e300]), None)
+        self.assertEqual(cache.get([2e300, -1e300]), None)
+        cache.put([5e-9], 'd')
+        self.assertEqual(cache.get([5000.0]), None)
+
+        # Points within the tolerance share a key, including around zero.
+        cache.put([2.0, -1e-14], 'c')
+        self.assertEqual(cache.get([2.0 + 1e-14, 1e-14]), 'c')
+
+    def test_evaluation_pool(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        from pyopt_driver.parallel import EvaluationPool
+
+        self.top = OptimizationConstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.pyopt_diff = True
+        self.top.run()
+
+        xs = [[float(i), -float(i)] for i in range(6)]
+        pool = EvaluationPool(self.top.driver, 2)
+        try:
+            unordered = dict(pool.imap_unordered(xs))
+        finally:
+            pool.close()
+
+        results = self.top.driver.evaluate_population(xs)
+
+        self.assertEqual(len(results), len(xs))
+        self.assertEqual(sorted(unordered.keys()), range(len(xs)))
+        for i, (x, (f, g, fail)) in enumerate(zip(xs, results)):
+            self.assertEqual(fail, 0)
+            self.assertEqual(unordered[i][2], 0)
+            expected = (x[0]-3.0)**2 + x[0]*x[1] + (x[1]+4.0)**2 - 3.0
+            assert_rel_error(self, f[0], expected, 0.0001)
+            assert_rel_error(self, unordered[i][0][0], expected, 0.0001)
+
+    def test_optimizer_args(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationUnconstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'ALPSO'
+        except ValueError:
+            raise SkipTest("ALPSO not present on this system")
+
+        # The arguments reach the constructor.
+        self.top.driver.optimizer_args = {'pll_type': None}
+        opt = self.top.driver._make_optimizer()
+        self.assertEqual(opt.__class__.__name__, 'ALPSO')
+
+        # ALPSO checks the parallel mode it is given.
+        self.top.driver.optimizer_args = {'pll_type': 'no_such_mode'}
+        self.assertRaises(ValueError, self.top.driver._make_optimizer)
+
+    def test_layout_reuse(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationUnconstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.pyopt_diff = True
+        self.top.run()
+
+        opt_prob = self.top.driver._opt_prob
+        solution = self.top.driver.pyOpt_solution
+
+        # Same structure, new starting point and bounds.
+        self.top.paraboloid.x = 10.0
+        self.top.paraboloid.y = 10.0
+        self.top.driver.get_parameters()['paraboloid.y'].low = -5.0
+        self.top.run()
+
+        self.assertTrue(self.top.driver._opt_prob is opt_prob)
+        self.assertTrue(self.top.driver.pyOpt_solution is not solution)
+        assert_rel_error(self, self.top.paraboloid.y, -5.0, 0.01)
+
+        # New constraint, new layout.
+        self.top.driver.get_parameters()['paraboloid.y'].low = -50.0
+        self.top.driver.add_constraint('paraboloid.x-paraboloid.y >= 15.0')
+        self.top.run()
+
+        self.assertTrue(self.top.driver._opt_prob is not opt_prob)
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+    def test_restore_best(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.pyopt_diff = True
+        self.top.driver.restore_best = True
+
+        self.top.run()
+
+        x = self.top.paraboloid.x
+        y = self.top.paraboloid.y
+        assert_rel_error(self, x, 7.175775, 0.01)
+        assert_rel_error(self, y, -7.824225, 0.01)
+        assert_rel_error(self, self.top.paraboloid.f_xy,
+                         (x-3.0)**2 + x*y + (y+4.0)**2 - 3.0, 0.0001)
+
+        # Move the model away from the solution, then put it back from a
+        # snapshot without running it.
+        from numpy import array
+        driver = self.top.driver
+        f_xy = self.top.paraboloid.f_xy
+        x_opt = array([x, y])
+        best = (x_opt, f_xy, driver._take_snapshot(driver.workflow))
+        driver._run_model(array([1.0, 2.0]))
+        self.assertEqual(self.top.paraboloid.x, 1.0)
+
+        count = self.top.paraboloid.exec_count
+        driver._final_run(x_opt, best)
+        self.assertEqual(self.top.paraboloid.exec_count, count)
+        self.assertEqual(self.top.paraboloid.x, x)
+        self.assertEqual(self.top.paraboloid.y, y)
+        self.assertEqual(self.top.paraboloid.f_xy, f_xy)
+
+    def test_history(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        from pyopt_driver.history import HistoryReader
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.top.driver.options = {}
+            self.top.driver.history_dir = tmpdir
+            self.top.driver.history_chunk = 3
+            self.top.run()
+
+            reader = HistoryReader(tmpdir)
+            self.assertEqual(reader.nparam, 2)
+            self.assertEqual(reader.nobj, 1)
+            self.assertEqual(reader.ncon, 1)
+            self.assertTrue(reader.num_evals() > 3)
+            self.assertTrue(reader.num_grads() > 0)
+
+            evals = reader.evals(1, 3)
+            self.assertEqual(evals['x'].shape, (2, 2))
+            for x, f in zip(evals['x'], evals['f']):
+                expected = (x[0]-3.0)**2 + x[0]*x[1] + (x[1]+4.0)**2 - 3.0
+                assert_rel_error(self, f[0], expected, 0.0001)
+
+            grads = reader.grads(-1)
+            self.assertEqual(grads['df'].shape, (1, 1, 2))
+            self.assertEqual(grads['dg'].shape, (1, 1, 2))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_history_flushed_per_call(self):
+
+        from pyopt_driver.history import HistoryReader, HistoryWriter
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            writer = HistoryWriter(tmpdir, 2, 1, 1, chunk_size=3)
+            for i in range(5):
+                writer.record_eval([float(i), 0.0], [2.0*i], [-1.0], 0, 0.1)
+            writer.record_grad([1.0, 0.0], [[1.0, 2.0]], [[0.0, 1.0]], 0,
+                               0.2)
+
+            # The writer is still open: one full chunk is in the index, and
+            # the rest is found from the size of the open chunk.
+            reader = HistoryReader(tmpdir)
+            self.assertEqual(reader.num_evals(), 5)
+            self.assertEqual(reader.num_grads(), 1)
+            evals = reader.evals()
+            self.assertEqual(list(evals['f'][:, 0]), [0.0, 2.0, 4.0, 6.0, 8.0])
+            self.assertEqual(list(reader.grads()['df'][0, 0]), [1.0, 2.0])
+
+            writer.close()
+            self.assertEqual(HistoryReader(tmpdir).num_evals(), 5)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_replay_unclosed_history(self):
+
+        from pyopt_driver.history import HistoryReader, HistoryReplay, \
+                                         HistoryWriter
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # A run that died: the writer is never closed.
+            writer = HistoryWriter(tmpdir, 2, 1, 1, chunk_size=2)
+            points = [[float(i), 1.0] for i in range(5)]
+            for x in points:
+                writer.record_eval(x, [x[0]**2], [-x[0]], 0, 0.1)
+            writer.record_grad(points[-1], [[8.0, 0.0]], [[-1.0, 0.0]], 0,
+                               0.1)
+
+            replay = HistoryReplay(HistoryReader(tmpdir), 1e-10, block=2)
+            for x in points:
+                f, g, fail = replay.next_eval(x)
+                self.assertEqual(fail, 0)
+                self.assertEqual(f[0], x[0]**2)
+            df, dg, fail = replay.next_grad(points[-1])
+            self.assertEqual(list(df[0]), [8.0, 0.0])
+
+            # Past the end of the recording, the replay stops.
+            self.assertEqual(replay.next_eval([5.0, 1.0]), None)
+            self.assertFalse(replay.active)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_hot_start_replay(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.top.driver.options = {}
+            self.top.driver.history_dir = tmpdir
+            self.top.run()
+            count = self.top.paraboloid.exec_count
+
+            self.top.paraboloid.x = 0.0
+            self.top.paraboloid.y = 0.0
+            self.top.driver.hot_start = True
+            self.top.run()
+
+            # Only the initial run and (at most) the final run execute.
+            self.assertTrue(self.top.paraboloid.exec_count - count <= 2)
+            assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+            assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_stats(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        calls = []
+        self.top.driver.options = {}
+        self.top.driver.collect_stats = True
+        self.top.driver.profile_slowest = 2
+        self.top.driver.stats_callback = \
+            lambda phase, elapsed, stats: calls.append(phase)
+        self.top.run()
+
+        stats = self.top.driver.stats
+        for phase in ('setup', 'optimizer', 'objfunc', 'gradfunc',
+                      'set_parameters', 'run_iteration', 'eval_objectives',
+                      'eval_constraints', 'calc_gradient'):
+            self.assertTrue(stats.phases[phase].count > 0, phase)
+            self.assertEqual(sum(stats.phases[phase].histogram),
+                             stats.phases[phase].count)
+
+        self.assertEqual(stats.phases['objfunc'].count, calls.count('objfunc'))
+        self.assertTrue(len(stats.slowest) <= 2)
+        self.assertTrue(stats.slowest[0][0] >= stats.slowest[-1][0])
+
     def test_array_CONMIN(self):
 
         try:
@@ -369,6 +792,202 @@ class pyOptDriverTestCase(unittest.TestCase):
 #        assert_rel_error(self, self.top.paraboloid.x[0], 7.175775, 0.01)
 #        assert_rel_error(self, self.top.paraboloid.x[1], -7.824225, 0.01)
 
+    def test_array_groups(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = ArrayOpt()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.add_constraint('paraboloid.x <= 40.0')
+
+        for i in range(2):
+            self.top.paraboloid.x = [0., 0.]
+            self.top.run()
+
+            assert_rel_error(self, self.top.paraboloid.x[0], 7.175775, 0.01)
+            assert_rel_error(self, self.top.paraboloid.x[1], -7.824225, 0.01)
+
+        # The array parameter and the vector constraint are grouped, but
+        # pyOpt still sees every scalar.
+        opt_prob = self.top.driver.pyOpt_solution
+        self.assertEqual(len(opt_prob.getVarSet()), 2)
+        self.assertEqual(len(opt_prob.getConSet()), 3)
+
+    def test_solution_vector(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        from numpy import array
+
+        class Var(object):
+            def __init__(self, value):
+                self.value = value
+
+        class Solution(object):
+            def __init__(self, values):
+                self._variables = dict((i, Var(value)) for i, value in
+                                       enumerate(values))
+
+        # A continuous scalar followed by an integer array parameter.
+        driver = pyOptDriver()
+        driver.nparam = 4
+        driver._int_idx = array([1, 2, 3])
+
+        x = driver._solution_vector(Solution([0.4, 1.6, -2.4, 2.7]))
+        self.assertEqual(list(x), [0.4, 2.0, -2.0, 3.0])
+
+        values = driver._parameter_values(x)
+        self.assertEqual(list(values), [0.4, 2, -2, 3])
+        self.assertTrue(all(isinstance(value, int) for value in values[1:]))
+
+    def test_set_parameters(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        from numpy import array
+
+        top = set_as_top(Assembly())
+        top.add('paraboloid', Paraboloid())
+        top.add('benchmark', BenchMark())
+        top.add('driver', pyOptDriver())
+        top.driver.workflow.add(['paraboloid', 'benchmark'])
+        top.driver.add_objective('paraboloid.f_xy')
+        top.driver.add_parameter('paraboloid.x', low=-50., high=50.)
+        top.driver.add_parameter('benchmark.x1', low=0, high=42)
+        top.driver.add_parameter('paraboloid.y', low=-50., high=50.)
+        self.top = top
+
+        driver = top.driver
+        driver._setup_problem()
+        self.assertEqual(list(driver._int_idx), [1])
+
+        # Continuous values go through as they are, integers are rounded.
+        driver._set_parameters(array([0.4, 2.6, -1.5]))
+        self.assertEqual(top.paraboloid.x, 0.4)
+        self.assertEqual(top.paraboloid.y, -1.5)
+        self.assertEqual(top.benchmark.x1, 3)
+        self.assertTrue(isinstance(top.benchmark.x1, int))
+
+        # Only the integer changed.
+        top.paraboloid.x = 7.0
+        driver._set_parameters(array([0.4, 5.2, -1.5]),
+                               array([0.4, 2.6, -1.5]))
+        self.assertEqual(top.benchmark.x1, 5)
+        self.assertEqual(top.paraboloid.x, 7.0)
+
+    def test_incremental(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        from numpy import array
+
+        self.top = set_as_top(Assembly())
+        self.top.add('p1', Paraboloid())
+        self.top.add('p2', Paraboloid())
+        self.top.add('driver', pyOptDriver())
+        self.top.driver.workflow.add(['p1', 'p2'])
+        self.top.driver.add_objective('p1.f_xy + p2.f_xy')
+        self.top.driver.add_parameter('p1.x', low=-50., high=50.)
+        self.top.driver.add_parameter('p2.x', low=-50., high=50.)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.pyopt_diff = True
+        self.top.driver.print_results = False
+        self.top.run()
+
+        assert_rel_error(self, self.top.p1.x, 3.0, 0.01)
+        assert_rel_error(self, self.top.p2.x, 3.0, 0.01)
+
+        # Moving p1.x only re-runs p1.
+        driver = self.top.driver
+        driver._model_x = array([self.top.p1.x, self.top.p2.x])
+        count1 = self.top.p1.exec_count
+        count2 = self.top.p2.exec_count
+        driver._run_model(array([self.top.p1.x + 1.0, self.top.p2.x]))
+        self.assertEqual(self.top.p1.exec_count, count1 + 1)
+        self.assertEqual(self.top.p2.exec_count, count2)
+
+        # Without a layout, as in an unpickled copy, every parameter is set.
+        driver._layout = None
+        driver._run_model(array([3.0, 4.0]))
+        self.assertEqual(self.top.p1.x, 3.0)
+        self.assertEqual(self.top.p2.x, 4.0)
+
+    def test_driver_fd(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrained()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.pyopt_diff = True
+        self.top.driver.fd_engine = 'driver'
+
+        for form in ['forward', 'backward', 'central', 'complex_step']:
+            self.top.paraboloid.x = 0.0
+            self.top.paraboloid.y = 0.0
+            self.top.driver.gradient_options.fd_form = form
+            self.top.run()
+
+            assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+            assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+        # The values pyOpt passes in are the base point, so a forward
+        # difference only runs the model at the perturbed points.
+        driver = self.top.driver
+        driver.gradient_options.fd_form = 'forward'
+        x = [1.0, 2.0]
+        f = [(x[0]-3.0)**2 + x[0]*x[1] + (x[1]+4.0)**2 - 3.0]
+        g = [15.0 - x[0] + x[1]]
+        count = self.top.paraboloid.exec_count
+        df, dg, fail = driver.fdfunc(x, f, g)
+        self.assertEqual(fail, 0)
+        self.assertEqual(self.top.paraboloid.exec_count - count, 2)
+        assert_rel_error(self, df[0, 0], 2.0*(1.0 - 3.0) + 2.0, 0.001)
+        assert_rel_error(self, df[0, 1], 1.0 + 2.0*(2.0 + 4.0), 0.001)
+        assert_rel_error(self, dg[0, 0], -1.0, 0.001)
+
+        self.top.driver.parallel_workers = 2
+        self.top.paraboloid.x = 0.0
+        self.top.paraboloid.y = 0.0
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
     def test_basic_CONMIN_derivatives(self):
 
         try:
@@ -393,6 +1012,395 @@ class pyOptDriverTestCase(unittest.TestCase):
         assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
         assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
 
+    def test_gradient_cache(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.title = 'Little Test with Gradient'
+        self.top.driver.options = {}
+        self.top.driver.cache_size = 100
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+        # Asking for the gradient away from the last point re-runs the model
+        # there first.
+        driver = self.top.driver
+        df, dg, fail = driver.gradfunc([1.0, 2.0], [], [])
+        self.assertEqual(fail, 0)
+        self.assertEqual(self.top.paraboloid.x, 1.0)
+        self.assertEqual(self.top.paraboloid.y, 2.0)
+        assert_rel_error(self, df[0, 0], 2.0*(1.0 - 3.0) + 2.0, 0.0001)
+        assert_rel_error(self, df[0, 1], 1.0 + 2.0*(2.0 + 4.0), 0.0001)
+
+    def test_sparse_constraint_gradient(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        driver = self.top.driver
+        driver.options = {}
+        driver.add_constraint('paraboloid.y <= 20.0')
+        driver.jacobian_sparsity = {'paraboloid.y <= 20.0': ['paraboloid.y']}
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+        df, dg, fail = driver.gradfunc([1.0, 2.0], [], [])
+        self.assertEqual(fail, 0)
+        self.assertEqual(dg.shape, (2, 2))
+        assert_rel_error(self, dg[0, 0], -1.0, 0.0001)
+        assert_rel_error(self, dg[0, 1], 1.0, 0.0001)
+        self.assertEqual(dg[1, 0], 0.0)
+        assert_rel_error(self, dg[1, 1], 1.0, 0.0001)
+
+        # Same again with the sparsity found from full gradients.
+        driver.jacobian_sparsity = {}
+        driver.detect_sparsity = True
+        self.top.paraboloid.x = 0.0
+        self.top.paraboloid.y = 0.0
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+    def test_detect_sparsity_zero_derivative(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        # At the start, the derivative of the new constraint with respect to
+        # x is zero, but it isn't anywhere else.
+        driver = self.top.driver
+        driver.options = {}
+        driver.add_constraint('paraboloid.x**2 - paraboloid.y <= 100.0')
+        driver.detect_sparsity = True
+        self.top.paraboloid.x = 0.0
+        self.top.paraboloid.y = 0.0
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+        self.assertTrue(driver._pattern[1, 0])
+
+        df, dg, fail = driver.gradfunc([5.0, 2.0], [], [])
+        self.assertEqual(fail, 0)
+        assert_rel_error(self, dg[1, 0], 10.0, 0.0001)
+        assert_rel_error(self, dg[1, 1], -1.0, 0.0001)
+
+    def test_active_set(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        driver = self.top.driver
+        driver.options = {}
+        driver.add_constraint('paraboloid.y <= 20.0')
+        driver.active_set = True
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+        # At (1, 2) the first constraint is violated and the second is far
+        # from active.
+        df, dg, fail = driver.gradfunc([1.0, 2.0], [], [16.0, -18.0])
+        self.assertEqual(fail, 0)
+        assert_rel_error(self, dg[0, 0], -1.0, 0.0001)
+        assert_rel_error(self, dg[0, 1], 1.0, 0.0001)
+        self.assertEqual(dg[1, 0], 0.0)
+        self.assertEqual(dg[1, 1], 0.0)
+
+    def test_linear_constraints(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        driver = self.top.driver
+        driver.options = {}
+        driver.linear_constraints = ['paraboloid.x-paraboloid.y >= 15.0']
+
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+        self.assertEqual(driver._linear.keys(), [0])
+
+        df, dg, fail = driver.gradfunc([1.0, 2.0], [], [])
+        self.assertEqual(fail, 0)
+        assert_rel_error(self, dg[0, 0], -1.0, 0.0001)
+        assert_rel_error(self, dg[0, 1], 1.0, 0.0001)
+
+        # Same again with the linear constraint found from the gradients.
+        driver.linear_constraints = []
+        driver.detect_linear = True
+        self.top.paraboloid.x = 0.0
+        self.top.paraboloid.y = 0.0
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+        self.assertEqual(driver._linear.keys(), [0])
+
+        driver.linear_constraints = ['paraboloid.x > 0']
+        self.assertRaises(ValueError, self.top.run)
+
+    def test_linear_recheck(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        # The cubic has the same gradient, (3, -1), at (0, 0) and (2, 1).
+        driver = self.top.driver
+        driver.add_constraint('(paraboloid.x-1.0)**3-paraboloid.y <= 100.0')
+        driver.detect_linear = True
+        driver.linear_recheck = 1
+        driver.run_iteration()
+        driver._setup_problem()
+
+        driver.gradfunc([0.0, 0.0], [], [])
+        driver.gradfunc([2.0, 1.0], [], [])
+        self.assertEqual(sorted(driver._linear.keys()), [0, 1])
+
+        # The next gradient checks them again and finds the cubic has moved.
+        df, dg, fail = driver.gradfunc([3.0, 2.0], [], [])
+        self.assertEqual(fail, 0)
+        assert_rel_error(self, dg[1, 0], 12.0, 0.0001)
+        assert_rel_error(self, dg[1, 1], -1.0, 0.0001)
+        self.assertEqual(driver._linear.keys(), [0])
+
+        df, dg, fail = driver.gradfunc([4.0, 3.0], [], [])
+        assert_rel_error(self, dg[0, 0], 1.0, 0.0001)
+        assert_rel_error(self, dg[1, 0], 27.0, 0.0001)
+
+    def test_derivative_direction(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+
+        # Two inputs, two outputs: forward.
+        self.top.run()
+        self.assertEqual(self.top.driver.derivative_direction, 'forward')
+
+        self.top.paraboloid.x = 0.0
+        self.top.paraboloid.y = 0.0
+        self.top.driver.gradient_options.derivative_direction = 'adjoint'
+        self.top.run()
+        self.assertEqual(self.top.driver.derivative_direction, 'adjoint')
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+    def test_multi_start(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        self.top = OptimizationConstrainedDerivatives()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        driver = self.top.driver
+        driver.options = {}
+        driver.multi_start = 4
+        driver.parallel_workers = 2
+
+        for sampling in ('lhs', 'sobol'):
+            driver.start_sampling = sampling
+            self.top.run()
+
+            assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+            assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+            self.assertEqual(len(driver.local_optima), 4)
+            for result in driver.local_optima:
+                self.assertTrue(result['feasible'])
+                self.assertTrue((abs(result['x0']) <= 50.0).all())
+                assert_rel_error(self, result['x'][0], 7.175775, 0.01)
+
+        # Serial runs are timed apart from the main run.
+        driver.parallel_workers = 1
+        driver.collect_stats = True
+        self.top.run()
+
+        stats = driver.stats
+        self.assertTrue(stats.phases['multi_start_objfunc'].count > 0)
+        self.assertTrue(stats.phases['multi_start_gradfunc'].count > 0)
+        self.assertTrue(stats.pyopt_overhead() >= 0.0)
+
+    def test_watchdog(self):
+
+        import signal
+        import time
+
+        from pyopt_driver.watchdog import EvaluationTimeout, Watchdog
+
+        if not hasattr(signal, 'setitimer'):
+            raise SkipTest("the watchdog needs SIGALRM")
+
+        def careless_model():
+            try:
+                time.sleep(5.0)
+            except Exception:
+                pass
+
+        # Broad exception handlers in the model don't stop the timeout.
+        start = time.time()
+        try:
+            with Watchdog(0.2):
+                careless_model()
+        except EvaluationTimeout:
+            pass
+        else:
+            self.fail("EvaluationTimeout was not raised")
+        self.assertTrue(time.time() - start < 2.0)
+        self.assertEqual(signal.getsignal(signal.SIGALRM), signal.SIG_DFL)
+
+    def test_eval_timeout(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        import time
+
+        class HangingParaboloid(Paraboloid):
+            """ Hangs for large x."""
+
+            def execute(self):
+                if self.x > 40.0:
+                    time.sleep(30.0)
+                super(HangingParaboloid, self).execute()
+
+        self.top = set_as_top(Assembly())
+        self.top.add('paraboloid', HangingParaboloid())
+        self.top.add('driver', pyOptDriver())
+        self.top.driver.workflow.add('paraboloid')
+        self.top.driver.add_objective('paraboloid.f_xy')
+        self.top.driver.add_parameter('paraboloid.x', low=-50., high=50.)
+        self.top.driver.add_parameter('paraboloid.y', low=-50., high=50.)
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        driver = self.top.driver
+        driver.options = {}
+        driver.pyopt_diff = True
+        driver.print_results = False
+        driver.eval_timeout = 1.0
+        driver.timeout_policy = 'blacklist'
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 6.6667, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.3333, 0.01)
+        self.assertEqual(driver.timeouts, 0)
+
+        start = time.time()
+        f, g, fail = driver.objfunc([45.0, 0.0])
+        self.assertEqual(fail, 1)
+        self.assertEqual(driver._timeouts, 1)
+
+        # The same point fails straight away the second time.
+        f, g, fail = driver.objfunc([45.0, 0.0])
+        self.assertEqual(fail, 1)
+        self.assertEqual(driver._timeouts, 1)
+        self.assertTrue(time.time() - start < 5.0)
+
+        # The model can still be run elsewhere.
+        f, g, fail = driver.objfunc([1.0, 2.0])
+        self.assertEqual(fail, 0)
+        assert_rel_error(self, f[0], 2.0*2.0 + 1.0*2.0 + 6.0*6.0 - 3.0,
+                         0.0001)
+
+        # A gradient away from the model's point re-runs it under the limit.
+        start = time.time()
+        df, dg, fail = driver.gradfunc([46.0, 0.0], [], [])
+        self.assertEqual(fail, 1)
+        self.assertEqual(driver._timeouts, 2)
+        self.assertTrue(time.time() - start < 5.0)
+
     def test_GA_multi_obj_multi_con(self):
         # Note, just verifying that things work functionally, rather than run
         # this for many generations.
@@ -428,6 +1436,51 @@ class pyOptDriverTestCase(unittest.TestCase):
 
         self.top.run()
 
+    def test_surrogate_screen(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        from numpy import array
+        from numpy.random import RandomState
+        from pyopt_driver.surrogate import SurrogateScreen
+
+        def func(x):
+            return array([(x[0]-1.0)**2 + (x[1]+2.0)**2]), \
+                   array([x[0] + x[1] - 4.0])
+
+        screen = SurrogateScreen([-5.0, -5.0], [5.0, 5.0], 0, min_points=20,
+                                 radius=0.2)
+        for x in RandomState(0).uniform(-5.0, 5.0, (60, 2)):
+            screen.add(x, *func(x))
+
+        # Near the optimum, the candidate has to be run.
+        self.assertEqual(screen.screen([1.0, -2.0]), None)
+
+        # Far up the bowl, the prediction is good enough.
+        f, g = screen.screen([4.5, -4.5])
+        assert_rel_error(self, f[0], func([4.5, -4.5])[0][0], 0.05)
+        self.assertEqual(screen.true_evals, 60)
+        self.assertEqual(screen.surrogate_evals, 1)
+
+        self.top = MultiObjectiveOptimization()
+        set_as_top(self.top)
+
+        try:
+            self.top.driver.optimizer = 'NSGA2'
+        except ValueError:
+            raise SkipTest("NSGA2 not present on this system")
+
+        self.top.driver.options = {'PopSize': 100, 'maxGen': 5,
+                                   'PrintOut': 0}
+        self.top.driver.surrogate = True
+        self.top.run()
+
+        # The surrogate only starts screening after 20 real evaluations.
+        self.assertTrue(self.top.driver.true_evals >= 20)
+
     def test_ALPSO_integer_design_var(self):
 
         #    probNEW.py
@@ -457,6 +1510,56 @@ class pyOptDriverTestCase(unittest.TestCase):
         self.assertEqual(opt_problem.benchmark.x3, 12)
 
 
+    def test_initial_point_not_rerun(self):
+
+        try:
+            from pyopt_driver.pyopt_driver import pyOptDriver
+        except ImportError:
+            raise SkipTest("this test requires pyOpt to be installed")
+
+        class RecordingParaboloid(ParaboloidDerivative):
+            """ Keeps the point of every execution."""
+
+            def __init__(self):
+                super(RecordingParaboloid, self).__init__()
+                self.points = []
+
+            def execute(self):
+                self.points.append((self.x, self.y))
+                super(RecordingParaboloid, self).execute()
+
+        self.top = set_as_top(Assembly())
+        self.top.add('paraboloid', RecordingParaboloid())
+        self.top.add('driver', pyOptDriver())
+        self.top.driver.workflow.add('paraboloid')
+        self.top.driver.add_objective('paraboloid.f_xy')
+        self.top.driver.add_parameter('paraboloid.x', low=-50., high=50.)
+        self.top.driver.add_parameter('paraboloid.y', low=-50., high=50.)
+        self.top.driver.add_constraint('paraboloid.x-paraboloid.y >= 15.0')
+
+        try:
+            self.top.driver.optimizer = 'SLSQP'
+        except ValueError:
+            raise SkipTest("SLSQP not present on this system")
+
+        self.top.driver.options = {}
+        self.top.driver.print_results = False
+        self.top.paraboloid.x = 1.0
+        self.top.paraboloid.y = 2.0
+
+        count = self.top.paraboloid.exec_count
+        self.top.run()
+
+        assert_rel_error(self, self.top.paraboloid.x, 7.175775, 0.01)
+        assert_rel_error(self, self.top.paraboloid.y, -7.824225, 0.01)
+
+        # The optimizer's first request for the start point is answered
+        # from the initial run, so the model only runs there once.
+        points = self.top.paraboloid.points
+        self.assertEqual(self.top.paraboloid.exec_count - count, len(points))
+        self.assertEqual(points[0], (1.0, 2.0))
+        self.assertEqual(points.count((1.0, 2.0)), 1)
+
     def test_initial_run(self):
         # Test to make sure fix that put run_iteration
         #   at the top of the execute method is in place and working
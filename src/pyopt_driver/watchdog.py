@@ -0,0 +1,71 @@
+"""
+Wall-clock limit on model evaluations for the pyOpt driver.
+
+A model evaluation that hangs would otherwise stall the optimizer forever.
+The watchdog arms a SIGALRM timer around the evaluation. If the timer goes
+off, the handler raises EvaluationTimeout in the evaluating thread, which
+unwinds out of the model. It derives from BaseException, like
+KeyboardInterrupt, so that `except Exception` handlers inside the model don't
+swallow it. A blocking system call is interrupted by the signal, so the
+exception also reaches code that waits on an external process.
+
+Signals can only be handled in the main thread, so the watchdog is only
+armed there. Evaluations on the driver's worker processes also run in a
+main thread. Where SIGALRM isn't available, such as on Windows, evaluations
+run without a limit.
+"""
+
+import signal
+import threading
+
+
+class EvaluationTimeout(BaseException):
+    """ Raised when an evaluation runs over its time limit. It has to be
+    caught by name."""
+    pass
+
+
+class Watchdog(object):
+    """ Context manager that raises EvaluationTimeout in its body once
+    `timeout` seconds of wall-clock time have passed.
+
+    timeout: float
+        Time limit in seconds. 0 disables the watchdog.
+    """
+
+    def __init__(self, timeout):
+
+        self.timeout = timeout
+        self.armed = False
+        self._handler = None
+
+    def __enter__(self):
+
+        if self.timeout > 0.0 and hasattr(signal, 'setitimer') and \
+           isinstance(threading.current_thread(), threading._MainThread):
+            self._handler = signal.signal(signal.SIGALRM, self._expire)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+            self.armed = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.armed:
+            try:
+                signal.setitimer(signal.ITIMER_REAL, 0.0)
+            finally:
+                # The timer may go off just before it is stopped, so the
+                # handler is put back even then.
+                handler = self._handler
+                if handler is None:
+                    # The previous handler wasn't installed from Python.
+                    handler = signal.SIG_DFL
+                signal.signal(signal.SIGALRM, handler)
+                self.armed = False
+        return False
+
+    def _expire(self, signum, frame):
+        """ Signal handler for the timer."""
+
+        raise EvaluationTimeout('Evaluation ran for more than %g seconds' %
+                                self.timeout)